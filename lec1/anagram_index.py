@@ -0,0 +1,338 @@
+import bisect
+import mmap
+import struct
+import sys
+import time
+from array import array
+from pathlib import Path
+
+from question1 import get_dictionary
+
+# バイナリ形式のヘッダ: マジックナンバー, バージョン, キーの数, 単語の数,
+# 作った時の辞書ファイルの大きさ, 更新時刻(ns)
+MAGIC = b"ANAG"
+VERSION = 2
+HEADER = struct.Struct("<4sIIIQQ")
+INDEX_FILE = Path(__file__).parent / Path("anagrams/words.anagram_index")
+WORDS_FILE = Path(__file__).parent / Path("anagrams/words.txt")
+
+
+def sort_letters(word):
+    """単語の文字をソートしてアナグラムのキーにする
+
+    Tests:
+    >>> sort_letters('silent')
+    'eilnst'
+    >>> sort_letters('')
+    ''
+    """
+    return "".join(sorted(word))
+
+
+class AnagramIndex:
+    """ソート済みの文字列 -> アナグラムのリスト、の索引
+
+    get_sorted_dictionary と違って一度だけ作ればよく、検索は dict を引くだけなので O(1)。
+
+    Attributes:
+        table (dict[str, list[str]]): ソート済みの文字列をキーにした、アナグラムのリスト
+
+    Tests:
+    >>> index = AnagramIndex(['listen', 'silent', 'enlist', 'hello'])
+    >>> index.search('tinsel')
+    ['enlist', 'listen', 'silent']
+    >>> index.search('world')
+    []
+    >>> len(index)
+    4
+    """
+
+    def __init__(self, dictionary):
+        self.table = {}
+        for word in dictionary:
+            self.table.setdefault(sort_letters(word), []).append(word)
+        for anagrams in self.table.values():
+            anagrams.sort()
+
+    def __len__(self):
+        return sum(len(anagrams) for anagrams in self.table.values())
+
+    def search(self, word):
+        """wordのアナグラムを辞書から探して全て返す
+
+        Args:
+            word (str): 探したい文字列
+
+        Returns:
+            list[str]: ソート済みのアナグラム全て
+        """
+        return list(self.table.get(sort_letters(str(word)), []))
+
+    def add_word(self, word):
+        """辞書に単語を足す。そのキーのリストだけを更新する
+
+        Returns:
+            bool: 足したらTrue、すでにあったらFalse
+
+        Tests:
+        >>> index = AnagramIndex(['listen'])
+        >>> index.add_word('silent'), index.add_word('silent')
+        (True, False)
+        >>> index.search('tinsel')
+        ['listen', 'silent']
+        >>> index.remove_word('listen'), index.remove_word('listen')
+        (True, False)
+        >>> index.search('tinsel')
+        ['silent']
+        """
+        anagrams = self.table.setdefault(sort_letters(word), [])
+        position = bisect.bisect_left(anagrams, word)
+        if position < len(anagrams) and anagrams[position] == word:
+            return False
+        anagrams.insert(position, word)
+        return True
+
+    def remove_word(self, word):
+        """辞書から単語を消す
+
+        Returns:
+            bool: 消したらTrue、なかったらFalse
+        """
+        key = sort_letters(word)
+        anagrams = self.table.get(key, [])
+        position = bisect.bisect_left(anagrams, word)
+        if position == len(anagrams) or anagrams[position] != word:
+            return False
+        anagrams.pop(position)
+        if not anagrams:
+            del self.table[key]
+        return True
+
+    def search_many(self, words):
+        """複数の単語をまとめて検索する
+
+        Args:
+            words (Iterable[str]): 探したい文字列
+
+        Returns:
+            list[list[str]]: 入力と同じ順番のアナグラムのリスト
+        """
+        return [self.search(word) for word in words]
+
+    def search_file(self, file_name):
+        """anagrams/ 以下のクエリファイル(1行1単語)をまとめて検索する
+
+        Args:
+            file_name (str): "large.txt" などのファイル名
+
+        Returns:
+            list[list[str]]: 各行のアナグラムのリスト
+        """
+        return self.search_many(read_queries(file_name))
+
+    def save(self, file_path=INDEX_FILE, source_path=None):
+        """索引をバイナリ形式で保存する
+
+        source_path を渡すと、その辞書ファイルの大きさと更新時刻をヘッダに書いておく。
+        load_or_build はこれを見て、辞書ファイルが変わっていたら索引を作り直す。
+
+        形式(すべてリトルエンディアン):
+            ヘッダ (MAGIC, VERSION, キーの数 K, 単語の数 W, 辞書ファイルの大きさ, 更新時刻)
+            キーのオフセット uint32 × (K+1)
+            各キーの最初の単語番号 uint32 × (K+1)
+            単語のオフセット uint32 × (W+1)
+            キーを連結したバイト列
+            単語を連結したバイト列
+        キーは昇順に並んでいるので、読み込み側は二分探索で検索できる。
+        """
+        key_offsets = array("I", [0])
+        group_starts = array("I", [0])
+        word_offsets = array("I", [0])
+        key_blob = bytearray()
+        word_blob = bytearray()
+        for key in sorted(self.table):
+            key_blob += key.encode()
+            key_offsets.append(len(key_blob))
+            for word in self.table[key]:
+                word_blob += word.encode()
+                word_offsets.append(len(word_blob))
+            group_starts.append(len(word_offsets) - 1)
+        for offsets in (key_offsets, group_starts, word_offsets):
+            if sys.byteorder != "little":
+                offsets.byteswap()
+        with open(file_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION,
+                    len(key_offsets) - 1, len(word_offsets) - 1,
+                    *(source_stamp(source_path) if source_path else (0, 0))))
+            key_offsets.tofile(f)
+            group_starts.tofile(f)
+            word_offsets.tofile(f)
+            f.write(key_blob)
+            f.write(word_blob)
+
+    @staticmethod
+    def load(file_path=INDEX_FILE):
+        """save() で保存した索引をメモリマップして読み込む"""
+        return MappedAnagramIndex(file_path)
+
+
+class MappedAnagramIndex:
+    """AnagramIndex.save() で保存したファイルを mmap したまま検索する索引
+
+    ファイルを全部パースしないので起動がほぼ一瞬で、検索はキーの二分探索で O(log N)。
+    AnagramIndex と同じ search / search_many / search_file を持つ。
+    読み込み専用なので、単語を足したり消したりする時は AnagramIndex を使って save し直す。
+    """
+
+    def __init__(self, file_path=INDEX_FILE):
+        with open(file_path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < HEADER.size:
+            self.buffer.close()
+            raise ValueError(f"{file_path} is not an anagram index file")
+        (magic, version, key_count, word_count,
+         self.source_size, self.source_mtime_ns) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buffer.close()
+            raise ValueError(f"{file_path} is not an anagram index file")
+        if sys.byteorder != "little":
+            self.buffer.close()
+            raise ValueError("mapped anagram index needs a little endian host")
+        self.key_count = key_count
+        self.word_count = word_count
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        self.key_offsets = view[offset: offset +
+                                4 * (key_count + 1)].cast("I")
+        offset += 4 * (key_count + 1)
+        self.group_starts = view[offset: offset +
+                                 4 * (key_count + 1)].cast("I")
+        offset += 4 * (key_count + 1)
+        self.word_offsets = view[offset: offset +
+                                 4 * (word_count + 1)].cast("I")
+        offset += 4 * (word_count + 1)
+        self.key_base = offset
+        self.word_base = offset + self.key_offsets[key_count]
+
+    def __len__(self):
+        return self.word_count
+
+    def key_at(self, i):
+        start = self.key_base + self.key_offsets[i]
+        end = self.key_base + self.key_offsets[i + 1]
+        return self.buffer[start:end]
+
+    def word_at(self, i):
+        start = self.word_base + self.word_offsets[i]
+        end = self.word_base + self.word_offsets[i + 1]
+        return self.buffer[start:end].decode()
+
+    def search(self, word):
+        target = sort_letters(str(word)).encode()
+        left = 0
+        right = self.key_count
+        while left < right:
+            center = (left + right) // 2
+            if self.key_at(center) < target:
+                left = center + 1
+            else:
+                right = center
+        if left == self.key_count or self.key_at(left) != target:
+            return []
+        return [self.word_at(i)
+                for i in range(self.group_starts[left], self.group_starts[left + 1])]
+
+    def search_many(self, words):
+        return [self.search(word) for word in words]
+
+    def search_file(self, file_name):
+        return self.search_many(read_queries(file_name))
+
+    def close(self):
+        # memoryview を先に解放しないと mmap を閉じられない
+        self.key_offsets.release()
+        self.group_starts.release()
+        self.word_offsets.release()
+        self.buffer.close()
+
+
+def read_queries(file_name):
+    file_path = Path(__file__).parent / Path("anagrams/" + file_name)
+    with open(file_path, "r") as f:
+        return [line.strip() for line in f]
+
+
+def source_stamp(source_path):
+    """辞書ファイルの (大きさ, 更新時刻 ns)。索引を作った後に辞書が変わったかを調べるのに使う"""
+    stat = Path(source_path).stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_or_build(file_path=INDEX_FILE, source_path=WORDS_FILE):
+    """保存済みの索引があれば mmap で読み込み、なければ作って保存する
+
+    保存済みの索引でも、古い形式だったり、作った時から source_path の大きさか更新時刻が
+    変わっていたりしたら、古い答えを返さないように作り直す。
+    """
+    if Path(file_path).exists():
+        try:
+            index = AnagramIndex.load(file_path)
+        except ValueError:  # 古いバージョンの形式
+            index = None
+        if index is not None:
+            if (index.source_size, index.source_mtime_ns) == source_stamp(source_path):
+                return index
+            index.close()
+    with open(source_path, "r") as f:
+        dictionary = [word.strip() for word in f]
+    AnagramIndex(dictionary).save(file_path, source_path)
+    return AnagramIndex.load(file_path)
+
+
+def functional_test(file_path):
+    dictionary = get_dictionary()
+    index = AnagramIndex(dictionary)
+    index.save(file_path)
+    mapped = AnagramIndex.load(file_path)
+    assert len(mapped) == len(index) == len(dictionary)
+    for word in ["hello", "silent", "wehre", "z", "a", "zzz", "1", "", 11]:
+        assert mapped.search(word) == index.search(word), word
+    assert mapped.search("silent") == [
+        "enlist", "inlets", "listen", "silent", "tinsel"]
+    mapped.close()
+
+    # 辞書ファイルが変わったら、load_or_build は保存済みの索引を使わずに作り直す
+    source_path = Path(file_path).with_name("words.txt")
+    source_path.write_text("listen\nsilent\n")
+    mapped = load_or_build(file_path, source_path)
+    assert mapped.search("tinsel") == ["listen", "silent"]
+    mapped.close()
+    source_path.write_text("listen\nsilent\ntinsel\n")
+    mapped = load_or_build(file_path, source_path)
+    assert mapped.search("enlist") == ["listen", "silent", "tinsel"]
+    mapped.close()
+    print("Functional tests passed!")
+
+
+def main():
+    start_time = time.perf_counter()
+    index = load_or_build()
+    load_time = time.perf_counter() - start_time
+    for data_file in ["small", "medium", "large"]:
+        start_time = time.perf_counter()
+        res = index.search_file(data_file + ".txt")
+        end_time = time.perf_counter()
+        found = sum(1 for anagrams in res if anagrams)
+        print(f"{data_file}: {len(res)} queries, {found} found, "
+              f"time: {end_time - start_time}s")
+    print(f"load time: {load_time}s")
+
+
+if __name__ == "__main__":
+    import doctest
+    import tempfile
+    doctest.testmod()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        functional_test(Path(tmp_dir) / "words.anagram_index")
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from anagram_index import AnagramIndex, sort_letters
+from benchmark import percentile
+from bitmask_search import BitmaskSearchEngine
+from question2 import get_dictionary
+
+# キャッシュに入れておくクエリの数
+CACHE_SIZE = 10000
+# パーセンタイルの計算に使う、直近のレイテンシの数
+LATENCY_WINDOW = 10000
+
+
+class LRUCache:
+    """最近使った順に max_size 個まで結果を覚えておくキャッシュ
+
+    Tests:
+    >>> cache = LRUCache(2)
+    >>> cache.put('a', 1); cache.put('b', 2)
+    >>> cache.get('a')
+    (1, True)
+    >>> cache.put('c', 3)  # 一番使われていない 'b' が消える
+    >>> cache.get('b')
+    (None, False)
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return (self.items[key], True)
+        self.misses += 1
+        return (None, False)
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class AnagramService:
+    """辞書と索引を一度だけ作って、question1/question2 の検索をキャッシュ付きで答える
+
+    キャッシュのキーは (モード, ソートした文字列)。並び順が違うだけのクエリは同じ答えになるので、まとめてヒットする。
+
+    サーバーでは handle_line_async を使う。キャッシュにない検索と辞書の更新は executor のスレッドで行うので、
+    遅いクエリがあってもイベントループは止まらず、他の接続のキャッシュにある答えや stats はすぐに返せる。
+    索引はスレッドセーフではないので、executor のスレッドは1つにして、検索と更新が重ならないようにする。
+
+    Attributes:
+        searchers (dict[str, Callable]): モード("anagram", "partial")ごとの検索関数
+        cache (LRUCache): 検索結果のキャッシュ。イベントループのスレッドだけが触る
+        generation (int): 辞書が変わるたびに増やす。検索の途中で変わったら、その答えはキャッシュしない
+        executor (ThreadPoolExecutor): キャッシュにない検索と辞書の更新をするスレッド
+        latencies (deque[float]): 直近のリクエストのレイテンシ(秒)
+    """
+
+    def __init__(self, dictionary, cache_size=CACHE_SIZE):
+        self.indexes = [AnagramIndex(dictionary),
+                        BitmaskSearchEngine(dictionary)]
+        self.searchers = {
+            "anagram": self.indexes[0].search,
+            "partial": self.indexes[1].search,
+        }
+        self.cache = LRUCache(cache_size)
+        self.generation = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+
+    def search(self, mode, word):
+        start_time = time.perf_counter()
+        key = (mode, sort_letters(word))
+        answer, found = self.cache.get(key)
+        if not found:
+            answer = self.searchers[mode](word)
+            self.cache.put(key, answer)
+        self.latencies.append(time.perf_counter() - start_time)
+        self.requests += 1
+        return answer
+
+    async def search_async(self, mode, word):
+        """search と同じだが、キャッシュにない時は executor のスレッドで探して、その間はほかのリクエストに答える"""
+        start_time = time.perf_counter()
+        key = (mode, sort_letters(word))
+        answer, found = self.cache.get(key)
+        if not found:
+            generation = self.generation
+            answer = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.searchers[mode], word)
+            if generation == self.generation:
+                self.cache.put(key, answer)
+        self.latencies.append(time.perf_counter() - start_time)
+        self.requests += 1
+        return answer
+
+    def update_indexes(self, command, word):
+        """全部の索引に単語を足す(add)・消す(remove)。どれかが変わったら True"""
+        changed = False
+        for index in self.indexes:
+            if command == "add":
+                changed = index.add_word(word) or changed
+            else:
+                changed = index.remove_word(word) or changed
+        return changed
+
+    def clear_cache(self):
+        """どのクエリの答えが変わるかわからないので、辞書が変わったらキャッシュは空にする"""
+        self.generation += 1
+        self.cache.items.clear()
+
+    def update(self, command, word):
+        """辞書に単語を足す(add)・消す(remove)"""
+        changed = self.update_indexes(command, word)
+        if changed:
+            self.clear_cache()
+        return changed
+
+    def stats(self):
+        """ヒット率とレイテンシのパーセンタイル(マイクロ秒)を返す"""
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "cache_size": len(self.cache.items),
+            "cache_max_size": self.cache.max_size,
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "hit_rate": self.cache.hit_rate(),
+            "latency_us": {
+                "p50": percentile(latencies, 50) * 1e6,
+                "p90": percentile(latencies, 90) * 1e6,
+                "p99": percentile(latencies, 99) * 1e6,
+                "max": (latencies[-1] if latencies else 0) * 1e6,
+            },
+        }
+
+    def handle_line(self, line):
+        """1行のリクエストに1行で答える
+
+        リクエスト:
+            anagram <word>  -> 全部の文字を使うアナグラムをスペース区切りで
+            partial <word>  -> 一部の文字を使う一番スコアが高い単語
+            add <word>      -> 辞書に単語を足す。足したら OK、すでにあったら NOOP
+            remove <word>   -> 辞書から単語を消す。消したら OK、なかったら NOOP
+            stats           -> 統計情報の JSON
+        """
+        command, _, word = line.strip().partition(" ")
+        if command in self.searchers:
+            answer = self.search(command, word.strip())
+            return " ".join(answer) if isinstance(answer, list) else answer
+        if command in ("add", "remove"):
+            return "OK" if self.update(command, word.strip()) else "NOOP"
+        if command == "stats":
+            return json.dumps(self.stats())
+        return "ERROR unknown command: " + command
+
+    async def handle_line_async(self, line):
+        """handle_line と同じだが、キャッシュにない検索と辞書の更新の間もイベントループを止めない"""
+        command, _, word = line.strip().partition(" ")
+        if command in self.searchers:
+            answer = await self.search_async(command, word.strip())
+            return " ".join(answer) if isinstance(answer, list) else answer
+        if command in ("add", "remove"):
+            changed = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.update_indexes, command, word.strip())
+            if changed:
+                self.clear_cache()
+            return "OK" if changed else "NOOP"
+        return self.handle_line(line)
+
+
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write((await service.handle_line_async(line.decode()) + "\n").encode())
+            await writer.drain()
+    except ConnectionError:  # ConnectionResetError, BrokenPipeError: 相手が先に切った
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve_socket(service, host, port):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port)
+    print(f"listening on {host}:{port}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_stdin(service):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        sys.stdout.write(await service.handle_line_async(line.decode()) + "\n")
+        sys.stdout.flush()
+    print(json.dumps(service.stats()), file=sys.stderr)
+
+
+def concurrency_test():
+    """キャッシュにない遅い検索の途中でも、ほかのリクエストに答えられるか確かめる
+
+    Tests:
+    >>> concurrency_test()
+    ['stats', 'partial']
+    """
+    service = AnagramService(["listen", "silent"])
+
+    def slow_search(word):
+        time.sleep(0.3)
+        return ""
+    service.searchers["partial"] = slow_search
+
+    async def run():
+        finished = []
+
+        async def request(line):
+            await service.handle_line_async(line)
+            finished.append(line.split()[0])
+        await asyncio.gather(request("partial abc"), request("stats"))
+        return finished
+    return asyncio.run(run())
+
+
+def main(argv=None):
+    """How to use:
+
+    $ python3 anagram_server.py --port 8765
+    $ printf 'partial aahlpooo\\nanagram silent\\nstats\\n' | nc localhost 8765
+    $ printf 'partial aahlpooo\\nstats\\n' | python3 anagram_server.py --stdin
+    """
+    parser = argparse.ArgumentParser(description="アナグラム検索サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stdin", action="store_true",
+                        help="ソケットではなく標準入出力で1行ずつ答える")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE)
+    args = parser.parse_args(argv)
+
+    start_time = time.perf_counter()
+    service = AnagramService(get_dictionary(), args.cache_size)
+    print(f"loaded in {time.perf_counter() - start_time:.3f}s", file=sys.stderr)
+    if args.stdin:
+        asyncio.run(serve_stdin(service))
+    else:
+        asyncio.run(serve_socket(service, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#! /usr/bin/python3
+
+import argparse
+import itertools
+import multiprocessing
+import sys
+
+# How to use:
+#
+# $ python3 fast_score_checker.py data_file your_answer_file
+# $ python3 fast_score_checker.py large.txt large_answer.txt --jobs 4 --per-line scores.tsv
+#
+# score_checker.py と同じ判定をするが、
+# - 辞書をsetで持つので、単語が辞書にあるかの判定が O(1)
+# - 26文字の個数を1つの整数に詰めて、1回の引き算で全文字の個数を比べる
+# - ファイルを1行ずつ読むので、どれだけ大きな答えのファイルでもメモリが増えない
+# - --jobs で行をチャンクに分けて並列に調べられる
+
+SCORES = [1, 3, 2, 2, 1, 3, 3, 1, 1, 4, 4, 2, 2, 1, 1, 3, 4, 1, 1, 1, 2, 3, 3, 4, 3, 4]
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+SCORE_TABLE = {character: score for character, score in zip(ALPHABET, SCORES)}
+# 1文字あたり 1byte (下位7bitが個数, 最上位bitがガード)
+GUARD = int.from_bytes(b"\x80" * len(ALPHABET), "little")
+MAX_COUNT = 0x7f
+
+WORDS_FILE = "words.txt"
+CHUNK_LINES = 10000
+
+valid_words = None
+
+
+def calculate_score(word):
+    """score_checker.calculate_score と同じ
+
+    Tests:
+    >>> calculate_score('alpha')
+    8
+    """
+    return sum(SCORE_TABLE[character] for character in word)
+
+
+def pack_counts(word):
+    """26文字の個数を1byteずつ1つの整数に詰める。MAX_COUNT 個を超える文字があれば ValueError
+
+    Tests:
+    >>> pack_counts('aab') == 2 + (1 << 8)
+    True
+    >>> pack_counts('a' * 128)
+    Traceback (most recent call last):
+    ...
+    ValueError: 'a' appears 128 times, more than 127
+    """
+    counts = [word.count(character) for character in ALPHABET]
+    for character, count in zip(ALPHABET, counts):
+        if count > MAX_COUNT:
+            raise ValueError(f"{character!r} appears {count} times, more than {MAX_COUNT}")
+    return int.from_bytes(bytes(counts), "little")
+
+
+def is_anagram(anagram, data):
+    """anagram が data の文字の一部だけで作れるか。
+
+    data の各byteにガードbitを立ててから引くと、個数が足りない文字のbyteだけガードbitが消える。
+    a-z 以外の文字を使っていたら作れないものとする。
+
+    Tests:
+    >>> is_anagram('alpha', 'aahlpooo')
+    True
+    >>> is_anagram('alpha', 'ahlpooo')
+    False
+    >>> is_anagram('', '')
+    True
+    >>> is_anagram('a' * 200, 'a' * 150), is_anagram('a' * 150, 'a' * 200)
+    (False, True)
+    """
+    if anagram.strip(ALPHABET):
+        return False
+    try:
+        return ((pack_counts(data) | GUARD) - pack_counts(anagram)) & GUARD == GUARD
+    except ValueError:
+        # 1byte に入らない個数の文字がある時は、詰めずに1文字ずつ比べる
+        return all(anagram.count(character) <= data.count(character) for character in ALPHABET)
+
+
+def read_words(word_file):
+    with open(word_file) as f:
+        return set(line.rstrip('\n') for line in f)
+
+
+def init_worker(word_file):
+    global valid_words
+    valid_words = read_words(word_file)
+
+
+def check_lines(lines):
+    """(行番号, クエリ, 答え) のリストを調べる
+
+    Returns:
+        Tuple(int, list[int], str): (スコアの合計, 各行のスコア, 最初のエラー。なければNone)
+    """
+    total = 0
+    scores = []
+    for i, data, answer in lines:
+        if not is_anagram(answer, data):
+            return total, scores, "line %d: '%s' is not an anagram of '%s'." % (i + 1, answer, data)
+        if answer not in valid_words:
+            return total, scores, "line %d: '%s' is not a valid word!" % (i + 1, answer)
+        score = calculate_score(answer)
+        scores.append(score)
+        total += score
+    return total, scores, None
+
+
+def iter_lines(data_file, answer_file):
+    """(行番号, クエリ, 答え) を1行ずつ返す。行数が合わなければ ValueError"""
+    with open(data_file) as data, open(answer_file) as answers:
+        for i, (data_line, answer_line) in enumerate(
+                itertools.zip_longest(data, answers)):
+            if data_line is None or answer_line is None:
+                raise ValueError("The number of words in %s and %s doesn't match." %
+                                 (data_file, answer_file))
+            yield i, data_line.rstrip('\n'), answer_line.rstrip('\n')
+
+
+def iter_chunks(lines, size=CHUNK_LINES):
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check(data_file, answer_file, jobs=1, per_line=None, word_file=WORDS_FILE):
+    """答えのファイルを調べて、スコアの合計を返す
+
+    Args:
+        jobs (int): 並列に調べるプロセス数
+        per_line (TextIO, optional): 各行の "行番号\\tスコア" を書き出す先
+
+    Returns:
+        Tuple(int, str): (スコアの合計, 最初のエラー。なければNone)
+    """
+    chunks = iter_chunks(iter_lines(data_file, answer_file))
+    total = 0
+    line_number = 0
+    if jobs > 1:
+        pool = multiprocessing.Pool(
+            jobs, initializer=init_worker, initargs=(word_file,))
+        results = pool.imap(check_lines, chunks)
+    else:
+        init_worker(word_file)
+        pool = None
+        results = map(check_lines, chunks)
+    try:
+        for chunk_total, scores, error in results:
+            total += chunk_total
+            if per_line:
+                for score in scores:
+                    per_line.write("%d\t%d\n" % (line_number + 1, score))
+                    line_number += 1
+            if error:
+                return total, error
+    except ValueError as e:
+        return total, str(e)
+    finally:
+        if pool:
+            pool.terminate()
+    return total, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_file")
+    parser.add_argument("answer_file")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="並列に調べるプロセス数")
+    parser.add_argument("--per-line",
+                        help="各行のスコアを書き出すファイル('-'なら標準出力)")
+    args = parser.parse_args(argv)
+
+    per_line = None
+    if args.per_line == "-":
+        per_line = sys.stdout
+    elif args.per_line:
+        per_line = open(args.per_line, "w")
+    try:
+        score, error = check(args.data_file, args.answer_file,
+                             args.jobs, per_line)
+    finally:
+        if per_line and per_line is not sys.stdout:
+            per_line.close()
+    if error:
+        print(error)
+        exit(1)
+    print('You answer is correct! Your score is %d.' % score)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+from pathlib import Path
+
+import question1
+import question2
+
+# How to use:
+#
+# $ python3 benchmark.py                         # 全部測って benchmark_results.json に書く
+# $ python3 benchmark.py --solvers q2-bitmask q2-numpy --datasets large synthetic-32x1000
+# $ python3 benchmark.py --save-baseline         # 結果を benchmark_baseline.json として保存
+#
+# benchmark_baseline.json があれば、それと比べて遅くなったものを REGRESSION として表示する。
+# ベースラインは測ったマシンでしか意味がないので、リポジトリには入れない(.gitignore)。
+# 変更を入れる前に手元で --save-baseline しておいて、変更の後にもう一度測って比べる。
+
+RESULT_FILE = Path(__file__).parent / Path("benchmark_results.json")
+BASELINE_FILE = Path(__file__).parent / Path("benchmark_baseline.json")
+# 合成クエリの (文字数, クエリ数)
+SYNTHETIC_SIZES = [(4, 1000), (8, 1000), (16, 1000), (32, 1000), (32, 10000)]
+# ベースラインよりこの割合以上遅くなったら REGRESSION
+REGRESSION_THRESHOLD = 0.2
+
+
+def build_q1_sorted_list(dictionary):
+    # 元の実装は検索のたびに辞書を並べ替えるので、とても遅い
+    return lambda word: question1.search_anagram(word, dictionary)
+
+
+def build_q1_index(dictionary):
+    from anagram_index import AnagramIndex
+    return AnagramIndex(dictionary).search
+
+
+def build_q2_counter(dictionary):
+    counted = question2.get_counted_dictionary(dictionary)
+    return lambda word: question2.search_anagram(word, counted)
+
+
+def build_q2_bitmask(dictionary):
+    from bitmask_search import BitmaskSearchEngine
+    return BitmaskSearchEngine(dictionary).search
+
+
+def build_q2_trie(dictionary):
+    from trie_search import LetterCountTrie
+    return LetterCountTrie(dictionary).search
+
+
+def build_q2_numpy(dictionary):
+    from numpy_search import NumpyBatchSolver
+    # クエリをまとめて解くソルバーなので、クエリのリストを受け取る関数を返す
+    return NumpyBatchSolver(dictionary).solve
+
+
+# 名前: (辞書を受け取って検索関数を返す関数, 1つのデータで測るクエリ数の上限, まとめて解くか)
+SOLVERS = {
+    "q1-sorted-list": (build_q1_sorted_list, 20, False),
+    "q1-index": (build_q1_index, None, False),
+    "q2-counter": (build_q2_counter, 1000, False),
+    "q2-bitmask": (build_q2_bitmask, None, False),
+    "q2-trie": (build_q2_trie, None, False),
+    "q2-numpy": (build_q2_numpy, None, True),
+}
+# --solvers で名前を書いた時だけ測るソルバー。
+# q2-trie は長いクエリ(large)で q2-counter より遅いので、普段は測らない
+OPT_IN_SOLVERS = ["q2-trie"]
+
+
+def synthetic_queries(length, count, seed=0):
+    """辞書の文字の出現頻度に合わせて、ランダムなクエリを作る
+
+    Tests:
+    >>> queries = synthetic_queries(5, 3)
+    >>> len(queries), [len(query) for query in queries]
+    (3, [5, 5, 5])
+    >>> queries == synthetic_queries(5, 3)
+    True
+    """
+    letters = "etaoinshrdlcumwfgypbvkjxqz"
+    weights = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8,
+               2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1]
+    rng = random.Random(f"{seed}-{length}-{count}")
+    return ["".join(rng.choices(letters, weights, k=length)) for _ in range(count)]
+
+
+def get_datasets():
+    datasets = {name: question2.get_data(name + ".txt")
+                for name in ["small", "medium", "large"]}
+    for length, count in SYNTHETIC_SIZES:
+        datasets[f"synthetic-{length}x{count}"] = synthetic_queries(
+            length, count)
+    return datasets
+
+
+def percentile(sorted_values, p):
+    """ソート済みのリストの p パーセンタイル(最近傍法)
+
+    Tests:
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([], 99)
+    0
+    """
+    if not sorted_values:
+        return 0
+    index = -(-len(sorted_values) * p // 100) - 1
+    return sorted_values[min(max(int(index), 0), len(sorted_values) - 1)]
+
+
+def peak_memory_mb():
+    """このプロセスの最大RSS(MB)。Linux は KB、macOS は byte で返ってくる"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def run_solver(name, dataset_names):
+    """1つのソルバーを測る。メモリを他のソルバーと混ぜないように、別プロセスで呼ばれる"""
+    builder, max_queries, batch = SOLVERS[name]
+    dictionary = question2.get_dictionary()
+    datasets = get_datasets()
+    start_time = time.perf_counter()
+    search = builder(dictionary)
+    build_time = time.perf_counter() - start_time
+
+    results = []
+    for dataset_name in dataset_names:
+        queries = datasets[dataset_name][:max_queries]
+        latencies = []
+        total_start = time.perf_counter()
+        if batch:
+            # 1クエリずつのレイテンシは測れないので、平均(全体の時間/クエリ数)を入れておく
+            search(queries)
+        else:
+            for query in queries:
+                start_time = time.perf_counter()
+                search(query)
+                latencies.append(time.perf_counter() - start_time)
+        total_time = time.perf_counter() - total_start
+        if batch and queries:
+            latencies = [total_time / len(queries)]
+        latencies.sort()
+        results.append({
+            "solver": name,
+            "dataset": dataset_name,
+            "queries": len(queries),
+            "batch": batch,
+            "build_time_s": build_time,
+            "total_time_s": total_time,
+            "throughput_qps": len(queries) / total_time if total_time else 0.0,
+            "latency_us": {
+                "p50": percentile(latencies, 50) * 1e6,
+                "p90": percentile(latencies, 90) * 1e6,
+                "p99": percentile(latencies, 99) * 1e6,
+                "max": (latencies[-1] if latencies else 0) * 1e6,
+            },
+            "peak_memory_mb": peak_memory_mb(),
+        })
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """ベースラインと比べて、遅くなったもの・メモリが増えたものを返す
+
+    Tests:
+    >>> old = [{"solver": "s", "dataset": "d", "build_time_s": 1.0, "throughput_qps": 100.0,
+    ...         "latency_us": {"p99": 10.0}, "peak_memory_mb": 50.0}]
+    >>> new = [{"solver": "s", "dataset": "d", "build_time_s": 1.1, "throughput_qps": 50.0,
+    ...         "latency_us": {"p99": 10.0}, "peak_memory_mb": 50.0}]
+    >>> compare(new, old)
+    [('s', 'd', 'throughput_qps', 100.0, 50.0)]
+    """
+    baseline_by_key = {(r["solver"], r["dataset"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_by_key.get((result["solver"], result["dataset"]))
+        if old is None:
+            continue
+        # (項目, 値の取り出し方, 大きいほど良いか)
+        metrics = [
+            ("build_time_s", lambda r: r["build_time_s"], False),
+            ("throughput_qps", lambda r: r["throughput_qps"], True),
+            ("latency_p99_us", lambda r: r["latency_us"]["p99"], False),
+            ("peak_memory_mb", lambda r: r["peak_memory_mb"], False),
+        ]
+        for metric, get, higher_is_better in metrics:
+            old_value, new_value = get(old), get(result)
+            if higher_is_better:
+                worse = new_value < old_value * (1 - threshold)
+            else:
+                worse = new_value > old_value * (1 + threshold)
+            if worse:
+                regressions.append(
+                    (result["solver"], result["dataset"], metric, old_value, new_value))
+    return regressions
+
+
+def print_scaling(results):
+    """合成クエリの文字数・クエリ数ごとのスループット(q/s)を、ソルバーごとに1行で表示する"""
+    synthetic = [f"synthetic-{length}x{count}" for length,
+                 count in SYNTHETIC_SIZES]
+    columns = [name for name in synthetic
+               if any(r["dataset"] == name for r in results)]
+    if not columns:
+        return
+    print("throughput (q/s) by synthetic query set:")
+    print(" " * 16 + "".join(f"{name[len('synthetic-'):]:>12}" for name in columns))
+    for solver in dict.fromkeys(r["solver"] for r in results):
+        by_dataset = {r["dataset"]: r for r in results if r["solver"] == solver}
+        print(f"{solver:>15} " + "".join(
+            f"{by_dataset[name]['throughput_qps']:>12.0f}" if name in by_dataset else " " * 12
+            for name in columns))
+
+
+def available_solvers():
+    solvers = [name for name in SOLVERS if name not in OPT_IN_SOLVERS]
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        solvers.remove("q2-numpy")
+    return solvers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="lec1 のアナグラムソルバーのベンチマーク")
+    parser.add_argument("--solvers", nargs="+", default=None,
+                        help="測るソルバー: " + ", ".join(SOLVERS))
+    parser.add_argument("--datasets", nargs="+", default=None,
+                        help="small, medium, large, synthetic-<文字数>x<クエリ数>")
+    parser.add_argument("--output", default=RESULT_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="結果をベースラインとして保存する")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="遅くなったものがあれば終了コード1で終わる")
+    args = parser.parse_args(argv)
+
+    solvers = args.solvers or available_solvers()
+    dataset_names = args.datasets or list(get_datasets())
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in solvers:
+        with context.Pool(1) as pool:
+            solver_results = pool.apply(run_solver, (name, dataset_names))
+        for r in solver_results:
+            print(f"{r['solver']:>15} {r['dataset']:>20}: build {r['build_time_s']:.3f}s, "
+                  f"{r['throughput_qps']:.0f} q/s, p50 {r['latency_us']['p50']:.1f}us, "
+                  f"p99 {r['latency_us']['p99']:.1f}us, peak {r['peak_memory_mb']:.1f}MB")
+        results.extend(solver_results)
+    print_scaling(results)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        return
+
+    if Path(args.baseline).exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline)
+        for solver, dataset, metric, old, new in regressions:
+            print(f"REGRESSION {solver} {dataset} {metric}: {old:.3f} -> {new:.3f}")
+        if not regressions:
+            print("no regressions against " + str(args.baseline))
+        if regressions and args.fail_on_regression:
+            exit(1)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
@@ -0,0 +1,309 @@
+import bisect
+import time
+from operator import mul
+
+from question2 import check_score, get_data, get_dictionary, save_answer_file
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+SCORES = [1, 3, 2, 2, 1, 3, 3, 1, 1, 4, 4, 2,
+          2, 1, 1, 3, 4, 1, 1, 1, 2, 3, 3, 4, 3, 4]
+# 辞書をいくつのチャンクに分けるか。見つかったチャンクで探索を打ち切れる
+CHUNK_COUNT = 8
+# 単語を足していってチャンクがこれの2倍より大きくなったら分ける
+MIN_CHUNK_SIZE = 1024
+# 消した単語(None)がチャンクのこの割合を超えたら詰めて作り直す
+MAX_DEAD_RATIO = 0.5
+
+
+def count_vector(word):
+    """26文字ぶんの個数のベクトルを返す
+
+    Tests:
+    >>> count_vector('abca')[:4]
+    [2, 1, 1, 0]
+    """
+    return [word.count(character) for character in ALPHABET]
+
+
+class WordChunk:
+    """スコアが近い単語のまとまり。単語ごとの個数ベクトルを縦に持ち替えたビット集合を持つ。
+
+    at_least[i][k] は「文字 i を k 個以上使う単語」の位置にビットを立てた整数。
+    at_least[i][1] は全単語の「文字 i を使うか」のビットを並べた、縦向きの文字マスクになっている。
+    クエリが文字 i を q 個しか持たないとき、at_least[i][q + 1] の単語は作れない。
+    26文字ぶん OR を取れば作れない単語が全部わかるので、単語ごとのループが要らない。
+
+    単語を足す時は上のビットをずらして入れ、消す時は alive のビットを落とすだけにする。
+    消した単語が MAX_DEAD_RATIO を超えたら、詰めてビット集合を作り直す。
+
+    Attributes:
+        words (list[str]): スコアが高い順(同じスコアなら辞書順)に並べた単語。消した単語は None
+        dead (int): words の中の None の数
+        counts (list[list[int]]): words の個数ベクトル
+        negative_scores (list[int]): words のスコアにマイナスをつけたもの(二分探索用に昇順)
+        alive (int): 検索対象の単語のビット
+        at_least (list[list[int]]): 上の説明の通り
+        min_score (int): このチャンクで一番低いスコア
+    """
+
+    def __init__(self, words):
+        self.words = words
+        self.counts = [count_vector(word) for word in words]
+        self.negative_scores = [-check_score(word) for word in words]
+        self.dead = 0
+        self.rebuild()
+
+    def insert(self, word):
+        """同じスコアの単語の一番後ろに word を入れる
+
+        入れる位置より上のビットを1つずつずらすだけなので、整数の演算が (文字 × 個数) 回で済む。
+        """
+        score = check_score(word)
+        counts = count_vector(word)
+        position = bisect.bisect_right(self.negative_scores, -score)
+        self.words.insert(position, word)
+        self.counts.insert(position, counts)
+        self.negative_scores.insert(position, -score)
+
+        low = (1 << position) - 1
+        bit = 1 << position
+
+        def shift(bits):
+            return (bits & low) | ((bits >> position) << (position + 1))
+
+        self.alive = shift(self.alive) | bit
+        for layers, count in zip(self.at_least, counts):
+            for k in range(1, len(layers)):
+                layers[k] = shift(layers[k])
+                if k <= count:
+                    layers[k] |= bit
+            for k in range(len(layers), count + 1):
+                layers.append(bit)
+        self.min_score = min(self.min_score, score) if len(
+            self.words) > 1 else score
+
+    def remove(self, word):
+        """word のビットを落とす。word は同じスコアの範囲だけで探す
+
+        消した単語が多くなったら compact する。作り直しは (MAX_DEAD_RATIO × チャンクの大きさ) 回の
+        remove に1回なので、ならすと1回あたりの手間は変わらない。
+
+        Tests:
+        >>> chunk = WordChunk(['ab', 'ba', 'a', 'b'])
+        >>> chunk.remove('ba')
+        >>> chunk.words, chunk.find(count_vector('ab'))
+        (['ab', None, 'a', 'b'], 'ab')
+        >>> chunk.remove('ab'); chunk.remove('b')  # 半分を超えたので詰める
+        >>> chunk.words, chunk.find(count_vector('ab'))
+        (['a'], 'a')
+        """
+        key = -check_score(word)
+        position = bisect.bisect_left(self.negative_scores, key)
+        while self.words[position] != word:
+            position += 1
+        self.words[position] = None
+        self.alive &= ~(1 << position)
+        self.dead += 1
+        if self.dead > len(self.words) * MAX_DEAD_RATIO:
+            self.compact()
+
+    def compact(self):
+        """消した単語を詰めて、ビット集合を作り直す"""
+        live = [position for position, word in enumerate(self.words)
+                if word is not None]
+        self.words = [self.words[position] for position in live]
+        self.counts = [self.counts[position] for position in live]
+        self.negative_scores = [self.negative_scores[position]
+                                for position in live]
+        self.dead = 0
+        self.rebuild()
+
+    def live_words(self):
+        return [word for word in self.words if word is not None]
+
+    def rebuild(self):
+        """words と counts からビット集合を作り直す。words に None がない時だけ呼ぶ"""
+        size = len(self.words)
+        self.alive = (1 << size) - 1
+        self.min_score = -self.negative_scores[-1] if self.words else 0
+        max_counts = [max(column, default=0) for column in zip(*self.counts)]
+        if not max_counts:
+            max_counts = [0] * len(ALPHABET)
+        layers = [[bytearray((size + 7) // 8) for _ in range(max_count + 1)]
+                  for max_count in max_counts]
+        for position, counts in enumerate(self.counts):
+            byte, bit = position >> 3, 1 << (position & 7)
+            for i, count in enumerate(counts):
+                for k in range(1, count + 1):
+                    layers[i][k][byte] |= bit
+        self.at_least = [[int.from_bytes(layer, "little") for layer in letter_layers]
+                         for letter_layers in layers]
+
+    def find(self, counts):
+        """countsから作れる単語のうち、一番前にあるものを返す。なければNone"""
+        impossible = 0
+        for layers, count in zip(self.at_least, counts):
+            if count + 1 < len(layers):
+                impossible |= layers[count + 1]
+        candidates = self.alive & ~impossible
+        if not candidates:
+            return None
+        return self.words[(candidates & -candidates).bit_length() - 1]
+
+
+def split_words(words, chunk_size):
+    """スコアが高い順の単語を、だいたい chunk_size 個ずつに分ける。同じスコアの単語は同じチャンクに入れる
+
+    Tests:
+    >>> split_words(['zz', 'b', 'aa', 'c', 'a'], 3)
+    [['zz', 'b', 'aa', 'c'], ['a']]
+    """
+    parts = []
+    start = 0
+    while start < len(words):
+        end = min(start + chunk_size, len(words))
+        while end < len(words) and check_score(words[end]) == check_score(words[end - 1]):
+            end += 1
+        parts.append(words[start:end])
+        start = end
+    return parts
+
+
+class BitmaskSearchEngine:
+    """get_counted_dictionary + search_word の代わりに使える検索エンジン
+
+    辞書を search_word と同じ「スコアが高い順」に並べて、スコアの区切りで CHUNK_COUNT 個の
+    WordChunk に分ける。クエリの個数ベクトルから、各チャンクで作れる単語を
+    整数の OR/AND だけで絞り込み、最初に見つかったチャンクの一番前の単語を答えにする。
+    クエリの全文字のスコアより低い単語しかないチャンクは見ずに飛ばす。
+
+    add_word / remove_word で、作り直さずに辞書を変えられる。
+
+    Attributes:
+        chunk_size (int): チャンクの目安の大きさ
+        chunks (list[WordChunk]): スコアが高い順のチャンク
+        locations (dict[str, WordChunk]): 単語がどのチャンクにあるか
+
+    Tests:
+    >>> engine = BitmaskSearchEngine(['a', 'ab', 'abcc', 'aaaaaaaaaaaaaabb'])
+    >>> engine.search('aahlpooo')
+    'a'
+    >>> engine.search('cbca')
+    'abcc'
+    >>> engine.search('')
+    ''
+    """
+
+    def __init__(self, dictionary, chunk_count=CHUNK_COUNT):
+        # sortedは安定なので、同じスコアの中では辞書の順番が保たれる(get_counted_dictionaryと同じ)
+        words = sorted(dictionary, key=check_score, reverse=True)
+        self.chunk_size = max(len(words) // chunk_count + 1, MIN_CHUNK_SIZE)
+        self.chunks = [WordChunk(part)
+                       for part in split_words(words, self.chunk_size)]
+        self.locations = {word: chunk
+                          for chunk in self.chunks for word in chunk.words}
+
+    def add_word(self, word):
+        """辞書に単語を足す。スコアの順番を保ったまま、そのスコアが入るチャンクだけ作り直す
+
+        同じスコアの単語の中では、足した単語は一番後ろ(辞書の最後に足したのと同じ)になる。
+
+        Returns:
+            bool: 足したらTrue、すでにあったらFalse
+
+        Tests:
+        >>> engine = BitmaskSearchEngine(['ab', 'a'])
+        >>> engine.search('abcc')
+        'ab'
+        >>> engine.add_word('abcc')
+        True
+        >>> engine.search('abcc')
+        'abcc'
+        >>> engine.remove_word('abcc')
+        True
+        >>> engine.search('abcc')
+        'ab'
+        >>> engine.remove_word('abcc')
+        False
+        """
+        if word in self.locations:
+            return False
+        score = check_score(word)
+        chunk = None
+        for candidate in self.chunks:
+            chunk = candidate
+            if candidate.min_score <= score:
+                break
+        if chunk is None:
+            chunk = WordChunk([])
+            self.chunks.append(chunk)
+        chunk.insert(word)
+        self.locations[word] = chunk
+        if len(chunk.words) > 2 * self.chunk_size:
+            # 大きくなりすぎたチャンクは分ける
+            index = self.chunks.index(chunk)
+            parts = [WordChunk(part) for part in split_words(
+                chunk.live_words(), self.chunk_size)]
+            self.chunks[index: index + 1] = parts
+            for part in parts:
+                for part_word in part.words:
+                    self.locations[part_word] = part
+        return True
+
+    def remove_word(self, word):
+        """辞書から単語を消す
+
+        Returns:
+            bool: 消したらTrue、なかったらFalse
+        """
+        chunk = self.locations.pop(word, None)
+        if chunk is None:
+            return False
+        chunk.remove(word)
+        return True
+
+    def search(self, word):
+        """wordの一部を使って作れる、一番スコアが高い単語を返す
+
+        Args:
+            word (str): 探したい文字列
+
+        Returns:
+            str: 一番スコアが高いアナグラム。見つからなければ空文字列
+        """
+        counts = count_vector(word)
+        upper_bound = sum(map(mul, SCORES, counts))
+        for chunk in self.chunks:
+            if chunk.min_score > upper_bound:
+                continue
+            answer = chunk.find(counts)
+            if answer is not None:
+                return answer
+        return ""
+
+    def search_many(self, words):
+        return [self.search(word) for word in words]
+
+
+def main():
+    """small, medium, large の答えを BitmaskSearchEngine で求めて保存する"""
+    start_time = time.perf_counter()
+    engine = BitmaskSearchEngine(get_dictionary())
+    print("build time: " + str(time.perf_counter() - start_time) + "s")
+    for data_file in ["small", "medium", "large"]:
+        data = get_data(data_file + ".txt")
+        start_time = time.perf_counter()
+        res = engine.search_many(data)
+        end_time = time.perf_counter()
+        save_answer_file(data_file, res)
+        with open("time.txt", "a") as f:
+            f.write(data_file + " time (bitmask): " +
+                    str(end_time - start_time) + "s\n")
+        print(data_file + " time (bitmask): " +
+              str(end_time - start_time) + "s")
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
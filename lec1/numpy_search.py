@@ -0,0 +1,140 @@
+import sys
+import time
+
+import numpy as np
+
+from question2 import check_score, get_data, get_dictionary, save_answer_file
+
+ALPHABET_SIZE = 26
+# 1回にまとめて調べるクエリの数
+CHUNK_SIZE = 1024
+# スコアが高い順に、この数の単語ずつ調べる。答えが見つかったクエリはそこで抜ける
+BLOCK_SIZE = 2048
+
+
+def count_matrix(words):
+    """単語のリストを (単語数 × 26) の個数行列にする
+
+    普通は uint8 にする。同じ文字が255個を超える単語がある時だけ uint32 にして、
+    頭打ちにして違う答えを返さないようにする(uint8 と uint32 はそのまま比べられる)。
+
+    Tests:
+    >>> count_matrix(['abca', ''])[:, :3].tolist()
+    [[2, 1, 1], [0, 0, 0]]
+    >>> matrix = count_matrix(['a' * 300])
+    >>> matrix.dtype, int(matrix[0, 0])
+    (dtype('uint32'), 300)
+    """
+    matrix = np.zeros((len(words), ALPHABET_SIZE), dtype=np.uint32)
+    for i, word in enumerate(words):
+        codes = np.frombuffer(word.encode("ascii", "ignore"),
+                              dtype=np.uint8).astype(np.intp) - ord('a')
+        codes = codes[(codes >= 0) & (codes < ALPHABET_SIZE)]
+        matrix[i] = np.bincount(codes, minlength=ALPHABET_SIZE)
+    if matrix.size == 0 or matrix.max() <= 255:
+        return matrix.astype(np.uint8)
+    return matrix
+
+
+class NumpyBatchSolver:
+    """辞書を個数行列で持ち、クエリをまとめてベクトル演算で解く
+
+    辞書は search_word と同じくスコアが高い順(同じスコアなら辞書順)に並べておく。
+    クエリのチャンクごとに、単語を BLOCK_SIZE 個ずつ取り出して
+    「単語の全文字の個数 <= クエリの個数」を (クエリ数 × BLOCK_SIZE) の bool 配列として一度に計算する。
+    作れない単語のスコアを -1 にして argmax を取れば、そのブロックで一番スコアが高い単語がわかる。
+    答えが見つかったクエリは次のブロックから外すので、たいていのクエリは辞書の先頭の方だけで済む。
+
+    Attributes:
+        words (list[str]): スコアが高い順に並べた辞書の単語
+        counts (np.ndarray): (単語数 × 26) の個数行列(count_matrix)
+        scores (np.ndarray): 各単語の check_score
+
+    Tests:
+    >>> solver = NumpyBatchSolver(['a', 'ab', 'abcc', 'aaaaaaaaaaaaaabb'])
+    >>> solver.solve(['aahlpooo', 'cbca', '', 'zzz'])
+    ['a', 'abcc', '', '']
+    >>> [len(word) for word in NumpyBatchSolver(['a' * 300, 'a']).solve(['a' * 256, 'a' * 300])]  # 255個で頭打ちにしない
+    [1, 300]
+    """
+
+    def __init__(self, dictionary, chunk_size=CHUNK_SIZE, block_size=BLOCK_SIZE):
+        # sortedは安定なので、同じスコアの中では辞書の順番が保たれる(get_counted_dictionaryと同じ)
+        self.words = sorted(dictionary, key=check_score, reverse=True)
+        self.counts = count_matrix(self.words)
+        self.scores = np.array([check_score(word)
+                               for word in self.words], dtype=np.int32)
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        # ブロックごとに、文字ごとの列を連続した配列にしておく。どの単語も使わない文字の列は飛ばす
+        self.blocks = []
+        for start in range(0, len(self.words), block_size):
+            block = self.counts[start: start + block_size]
+            columns = [(i, np.ascontiguousarray(block[:, i]))
+                       for i in range(ALPHABET_SIZE) if block[:, i].any()]
+            self.blocks.append(
+                (start, columns, self.scores[start: start + block_size]))
+
+    def solve_chunk(self, query_counts):
+        """(クエリ数 × 26) の個数行列に対する答えの単語番号を返す。作れない時は -1"""
+        answers = np.full(len(query_counts), -1, dtype=np.intp)
+        active = np.arange(len(query_counts))
+        for start, columns, scores in self.blocks:
+            if len(active) == 0:
+                break
+            queries = query_counts[active]
+            feasible = np.ones((len(active), len(scores)), dtype=np.bool_)
+            for i, column in columns:
+                feasible &= column[np.newaxis, :] <= queries[:, i, np.newaxis]
+            masked_scores = np.where(feasible, scores[np.newaxis, :], -1)
+            best = np.argmax(masked_scores, axis=1)
+            found = masked_scores[np.arange(len(best)), best] >= 0
+            answers[active[found]] = start + best[found]
+            active = active[~found]
+        return answers
+
+    def solve(self, queries):
+        """クエリのリストの答えをまとめて返す
+
+        Args:
+            queries (list[str]): クエリの文字列
+
+        Returns:
+            list[str]: 一番スコアが高いアナグラム。作れない時は空文字列
+        """
+        query_counts = count_matrix(queries)
+        answers = []
+        for start in range(0, len(queries), self.chunk_size):
+            indexes = self.solve_chunk(
+                query_counts[start: start + self.chunk_size])
+            answers.extend(self.words[i] if i >= 0 else "" for i in indexes)
+        return answers
+
+    def solve_file(self, data_file):
+        """anagrams/<data_file>.txt を解いて anagrams/<data_file>_answer.txt に保存する"""
+        answers = self.solve(get_data(data_file + ".txt"))
+        save_answer_file(data_file, answers)
+        return answers
+
+
+def main(data_files):
+    start_time = time.perf_counter()
+    solver = NumpyBatchSolver(get_dictionary())
+    print("build time: " + str(time.perf_counter() - start_time) + "s")
+    for data_file in data_files:
+        start_time = time.perf_counter()
+        solver.solve_file(data_file)
+        end_time = time.perf_counter()
+        with open("time.txt", "a") as f:
+            f.write(data_file + " time (numpy): " +
+                    str(end_time - start_time) + "s\n")
+        print(data_file + " time (numpy): " +
+              str(end_time - start_time) + "s")
+
+
+if __name__ == "__main__":
+    # How to use:
+    # $ python3 numpy_search.py [small medium large]
+    import doctest
+    doctest.testmod()
+    main(sys.argv[1:] or ["small", "medium", "large"])
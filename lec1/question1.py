@@ -50,6 +50,9 @@ def get_sorted_dictionary(dictionary):
 
 
 def search_anagram(word, dictionary):
+    # 作成済みの索引(anagram_index.AnagramIndex)が渡されたら、並び替えずにそのまま引く
+    if hasattr(dictionary, "search"):
+        return dictionary.search(word)
     new_dictionary = get_sorted_dictionary(dictionary)
     sorted_word = "".join(sorted(word))
     anagrams = binary_search(sorted_word, new_dictionary)
@@ -1,7 +1,15 @@
 from pathlib import Path
+import bisect
+import multiprocessing
+import os
+import sys
 import time
 from collections import Counter
 
+# 並列実行時にワーカープロセスが使う辞書。parallel_search に渡された辞書を init_worker で入れる。
+# fork できる環境では Pool を作る前に親プロセスでも入れておくので、子プロセスはコピーせずにそのまま使える
+worker_dictionary = None
+
 
 def save_answer_file(file_name, answers):
     answer_file = Path(__file__).parent / \
@@ -88,6 +96,63 @@ def get_counted_dictionary(dictionary):
     return new_dictionary
 
 
+def find_word(dictionary, word):
+    """get_counted_dictionary の辞書での word の位置を返す。同じスコアの範囲だけを探す。なければNone"""
+    key = -check_score(word)
+    position = bisect.bisect_left(
+        dictionary, key, key=lambda item: -check_score(item[1]))
+    while position < len(dictionary) and -check_score(dictionary[position][1]) == key:
+        if dictionary[position][1] == word:
+            return position
+        position += 1
+    return None
+
+
+def add_word(dictionary, word):
+    """get_counted_dictionary の辞書に、スコアが高い順を保ったまま単語を足す
+
+    同じスコアの単語の中では一番後ろに入るので、辞書の最後に足してから作り直したのと同じになる。
+    作り直す O(N log N) の代わりに、二分探索とリストへの挿入だけで済む。
+
+    Args:
+        dictionary (list[Tuple(Counter(str), str)]): get_counted_dictionary の辞書
+        word (str): 足したい単語
+
+    Returns:
+        bool: 足したらTrue、すでにあったらFalse
+
+    Tests:
+    >>> dictionary = get_counted_dictionary(['abcc', 'a'])
+    >>> add_word(dictionary, 'ab'), add_word(dictionary, 'ab')
+    (True, False)
+    >>> [word for _, word in dictionary]
+    ['abcc', 'ab', 'a']
+    >>> remove_word(dictionary, 'abcc'), remove_word(dictionary, 'abcc')
+    (True, False)
+    >>> [word for _, word in dictionary]
+    ['ab', 'a']
+    """
+    if find_word(dictionary, word) is not None:
+        return False
+    position = bisect.bisect_right(
+        dictionary, -check_score(word), key=lambda item: -check_score(item[1]))
+    dictionary.insert(position, (Counter(word), word))
+    return True
+
+
+def remove_word(dictionary, word):
+    """get_counted_dictionary の辞書から単語を消す
+
+    Returns:
+        bool: 消したらTrue、なかったらFalse
+    """
+    position = find_word(dictionary, word)
+    if position is None:
+        return False
+    dictionary.pop(position)
+    return True
+
+
 def search_anagram(word, dictionary):
     """辞書からwordの一部を使ったアナグラムを探す
 
@@ -104,13 +169,85 @@ def search_anagram(word, dictionary):
     >>> search_anagram('', [(Counter('alpha'), 'alpha')])
     ''
     """
+    # 作成済みの検索エンジン(bitmask_search.BitmaskSearchEngine など)が渡されたらそれを使う
+    if hasattr(dictionary, "search"):
+        return dictionary.search(word)
     counted_word = Counter(word)
     anagram = search_word(counted_word, dictionary)
     return anagram
 
 
-def main():
-    """与えられた文字列の一部を使ったAnagramを辞書ファイルから探して全て返す"""
+def init_worker(dictionary):
+    """ワーカーの初期化。parallel_search に渡された辞書を worker_dictionary に入れる
+
+    spawn の環境では辞書はワーカーごとに一度だけ pickle して送られる。
+    辞書ファイルから作り直さないので、add_word/remove_word で変えた辞書や別の辞書でも fork と同じ答えになる。
+    """
+    global worker_dictionary
+    worker_dictionary = dictionary
+
+
+def search_shard(shard):
+    """ワーカープロセスで、クエリの一部分(シャード)をまとめて探索する
+
+    Args:
+        shard (Tuple(int, list[str])): (シャードの番号, クエリ)
+
+    Returns:
+        Tuple(int, list[str], int, float): (シャードの番号, 答え, プロセスID, かかった時間)
+    """
+    shard_index, queries = shard
+    start_time = time.perf_counter()
+    answers = [search_anagram(query, worker_dictionary) for query in queries]
+    return shard_index, answers, os.getpid(), time.perf_counter() - start_time
+
+
+def parallel_search(data, dictionary, processes, shards_per_process=4):
+    """クエリを複数のプロセスに分けて探索し、入力と同じ順番で答えを返す
+
+    辞書はタスクごとに pickle して送らず、fork の前にグローバル変数に入れて共有する。
+
+    Args:
+        data (list[str]): クエリ
+        dictionary: get_counted_dictionary の辞書、または search を持つ検索エンジン
+        processes (int): プロセス数
+        shards_per_process (int): 1プロセスあたりのシャード数。多いほど負荷が均等になる
+
+    Returns:
+        Tuple(list[str], dict[int, Tuple(int, float)]):
+            答えと、ワーカーごとの (処理したクエリ数, かかった時間)
+    """
+    global worker_dictionary
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        worker_dictionary = dictionary
+    else:
+        context = multiprocessing.get_context("spawn")
+    shard_count = max(1, processes * shards_per_process)
+    shard_size = (len(data) + shard_count - 1) // shard_count or 1
+    shards = [(i, data[start: start + shard_size])
+              for i, start in enumerate(range(0, len(data), shard_size))]
+
+    results = [None] * len(shards)
+    worker_stats = {}
+    try:
+        with context.Pool(processes, initializer=init_worker, initargs=(dictionary,)) as pool:
+            for shard_index, answers, pid, elapsed in pool.imap_unordered(search_shard, shards):
+                results[shard_index] = answers
+                count, total = worker_stats.get(pid, (0, 0.0))
+                worker_stats[pid] = (count + len(answers), total + elapsed)
+    finally:
+        # 途中で例外が出ても、親プロセスに古い辞書を残さない
+        worker_dictionary = None
+    return [answer for answers in results for answer in answers], worker_stats
+
+
+def main(processes=None):
+    """与えられた文字列の一部を使ったAnagramを辞書ファイルから探して全て返す
+
+    Args:
+        processes (int, optional): 並列に探索するプロセス数. Noneなら1プロセスで順番に探索する.
+    """
     data_files = ["small", "medium"]
     dictionary = get_counted_dictionary(get_dictionary())
     for data_file in data_files:
@@ -119,21 +256,35 @@ def main():
 
         # 探索
         start_time = time.perf_counter()
-        for i, d in enumerate(data):
-            anagram = search_anagram(d, dictionary)
-            if i % 100 == 0:
-                print(i, anagram)
-            res.append(anagram)
+        if processes:
+            res, worker_stats = parallel_search(data, dictionary, processes)
+        else:
+            for i, d in enumerate(data):
+                anagram = search_anagram(d, dictionary)
+                if i % 100 == 0:
+                    print(i, anagram)
+                res.append(anagram)
         end_time = time.perf_counter()
 
         # 結果を出力
         save_answer_file(data_file, res)
+        lines = [data_file + " time: " + str(end_time - start_time) + "s"]
+        if processes:
+            lines[0] = data_file + " time (" + str(processes) + \
+                " processes): " + str(end_time - start_time) + "s"
+            for pid, (count, elapsed) in sorted(worker_stats.items()):
+                lines.append("  worker " + str(pid) + ": " + str(count) + " queries, " +
+                             str(count / elapsed if elapsed else 0) + " queries/s")
         with open("time.txt", "a") as f:
-            f.write(data_file + " time: " + str(end_time - start_time) + "s\n")
-        print(data_file + " time: " + str(end_time - start_time) + "s")
+            for line in lines:
+                f.write(line + "\n")
+        for line in lines:
+            print(line)
 
 
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
-    main()
+    # How to use:
+    # $ python3 question2.py [processes]
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
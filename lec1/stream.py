@@ -0,0 +1,140 @@
+import argparse
+import contextlib
+import gc
+import io
+import sys
+import tempfile
+from pathlib import Path
+
+# 出力ファイルをまとめて書き出す大きさ(バイト)。標準出力は sys.stdout のバッファをそのまま使う
+BUFFER_SIZE = 1 << 16
+
+
+def iter_queries(lines):
+    """行のイテラブルから、1行ずつクエリを取り出すジェネレータ。readlines() と違って全部は読み込まない
+
+    Tests:
+    >>> list(iter_queries(io.StringIO('abc\\n de \\n')))
+    ['abc', 'de']
+    """
+    for line in lines:
+        yield line.strip()
+
+
+def iter_answers(queries, search):
+    """クエリを1つずつ search して、答えをすぐに返すジェネレータ
+
+    Tests:
+    >>> list(iter_answers(iter(['b', 'a']), str.upper))
+    ['B', 'A']
+    """
+    for query in queries:
+        yield search(query)
+
+
+def format_answer(answer):
+    """question1 の答え(list)はスペース区切り、question2 の答え(str)はそのまま1行にする
+
+    Tests:
+    >>> format_answer(['listen', 'silent'])
+    'listen silent'
+    >>> format_answer('alpha')
+    'alpha'
+    """
+    if isinstance(answer, list):
+        return " ".join(answer)
+    return str(answer)
+
+
+def write_answers(answers, output, flush_lines=None):
+    """答えを1行ずつ output に書く。output 側のバッファに任せて、まとめて書き出す
+
+    Args:
+        answers (Iterable): 答え
+        output (TextIO): 書き込み先
+        flush_lines (int, optional): この行数ごとに flush する。パイプの先にすぐ流したい時に使う
+
+    Returns:
+        int: 書いた行数
+
+    Tests:
+    >>> out = io.StringIO()
+    >>> write_answers(iter([['a', 'b'], 'c']), out)
+    2
+    >>> out.getvalue()
+    'a b\\nc\\n'
+    """
+    count = 0
+    for answer in answers:
+        output.write(format_answer(answer) + "\n")
+        count += 1
+        if flush_lines and count % flush_lines == 0:
+            output.flush()
+    output.flush()
+    return count
+
+
+def get_searcher(mode):
+    """'anagram' なら question1、'partial' なら question2 の検索関数を返す。索引は最初に一度だけ作る"""
+    if mode == "anagram":
+        from anagram_index import load_or_build
+        return load_or_build().search
+    from bitmask_search import BitmaskSearchEngine
+    from question2 import get_dictionary
+    return BitmaskSearchEngine(get_dictionary()).search
+
+
+def main(argv=None):
+    """How to use:
+
+    $ cat anagrams/large.txt | python3 stream.py partial > answer.txt
+    $ python3 stream.py anagram anagrams/medium.txt -o answer.txt
+    """
+    parser = argparse.ArgumentParser(
+        description="クエリを1行ずつ読んで、答えを1行ずつ書き出す")
+    parser.add_argument("mode", choices=["anagram", "partial"],
+                        help="anagram: question1 (全部の文字を使う), partial: question2 (一部の文字を使う)")
+    parser.add_argument("input", nargs="?",
+                        help="クエリのファイル。省略すると標準入力")
+    parser.add_argument("-o", "--output", help="出力ファイル。省略すると標準出力")
+    parser.add_argument("--flush-lines", type=int, default=None,
+                        help="この行数ごとに出力を flush する")
+    args = parser.parse_args(argv)
+
+    search = get_searcher(args.mode)
+    input_file = open(args.input, "r") if args.input else sys.stdin
+    # sys.stdout はもともとバッファされているので、そのまま書く。
+    # sys.stdout.buffer を別の BufferedWriter で包むと、それが消える時に本物の標準出力が閉じられてしまう
+    output_file = open(args.output, "w", buffering=BUFFER_SIZE) if args.output else sys.stdout
+    try:
+        write_answers(iter_answers(iter_queries(input_file), search),
+                      output_file, args.flush_lines)
+    finally:
+        if args.input:
+            input_file.close()
+        if args.output:
+            output_file.close()
+
+
+def stdout_test():
+    """標準出力に書く main を2回呼んだ後も、print できるか(標準出力を閉じていないか)確かめる
+
+    Tests:
+    >>> stdout_test()
+    'enlist inlets listen silent tinsel\\nenlist inlets listen silent tinsel\\nstill open\\n'
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        query_path = Path(tmp_dir) / "queries.txt"
+        query_path.write_text("silent\n")
+        # doctest の sys.stdout には buffer がないので、本物と同じくファイルの上の TextIOWrapper にする
+        with open(Path(tmp_dir) / "stdout.txt", "w") as stdout:
+            with contextlib.redirect_stdout(stdout):
+                main(["anagram", str(query_path)])
+                main(["anagram", str(query_path)])
+                gc.collect()
+                print("still open")
+        return (Path(tmp_dir) / "stdout.txt").read_text()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import time
+
+from question2 import (check_score, get_counted_dictionary, get_data,
+                       get_dictionary, search_anagram)
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+# How to use:
+#
+# $ python3 trie_search.py                            # search_word(Counter のリスト)と速さを比べる
+# $ python3 benchmark.py --solvers q2-counter q2-trie  # benchmark.py では名前を書いた時だけ測る
+#
+# 短いクエリ(medium は平均16文字)では 3.3s → 0.37s と速いが、長いクエリ(large は平均36文字)では
+# ほとんどの枝が深い所まで作れるままなので枝が切れず、8.8s と search_word(3.2s) より遅い。
+# なので question2 の代わりには使わず、比較用に置いておく。
+
+
+class TrieNode:
+    """LetterCountTrie のノード
+
+    Attributes:
+        best (Tuple(int, int)): この下で一番いい単語の (スコア, -辞書での位置)。
+                                スコアが同じなら辞書で先に出てくる単語ほど大きい
+        word (str): 葉の時だけ、この個数の組み合わせで一番いい単語。それ以外は None
+        children (dict[int, TrieNode] | list[Tuple(int, TrieNode)]):
+            作っている間は 次の文字の個数 -> 子ノード の dict。
+            LetterCountTrie.finalize の後は (次の文字の個数, 子ノード) を best が大きい順に並べたリスト
+    """
+    __slots__ = ("best", "word", "children")
+
+    def __init__(self):
+        self.best = (-1, 0)
+        self.word = None
+        self.children = {}
+
+
+class LetterCountTrie:
+    """文字の個数をキーにしたトライ木で、クエリから作れる一番スコアが高い単語を探す
+
+    深さ d のノードの子は「letter_order[d] を何個使うか」で分かれていて、深さ26の葉に単語がある。
+    各ノードに、その下で一番高いスコア(best)を持たせておき、分枝限定法で探索する:
+    - クエリの個数より多く文字を使う子は、丸ごと作れないので飛ばす
+    - best がそれまでに見つけた答え以下の子は、答えを更新できないので飛ばす
+    文字の順番は使われる単語が少ない順にする。珍しい文字を使わないクエリで、上の方で枝を切れる。
+
+    search を持つので search_anagram に渡せる。長いクエリでは search_word より遅い(上のコメント)。
+
+    Tests:
+    >>> trie = LetterCountTrie(['a', 'ab', 'abcc', 'aaaaaaaaaaaaaabb'])
+    >>> search_anagram('aahlpooo', trie)
+    'a'
+    >>> trie.search('cbca')
+    'abcc'
+    >>> trie.search('')
+    ''
+    >>> LetterCountTrie(['ab', 'ba']).search('ab')  # 同じスコアなら辞書で先の単語
+    'ab'
+    """
+
+    def __init__(self, dictionary):
+        words = list(dictionary)
+        counts = [[word.count(character) for character in ALPHABET]
+                  for word in words]
+        usage = [sum(1 for count in counts if count[i])
+                 for i in range(len(ALPHABET))]
+        self.letter_order = sorted(
+            range(len(ALPHABET)), key=lambda i: usage[i])
+        self.root = TrieNode()
+        for position, (word, count) in enumerate(zip(words, counts)):
+            node = self.root
+            for letter in self.letter_order:
+                child = node.children.get(count[letter])
+                if child is None:
+                    child = node.children[count[letter]] = TrieNode()
+                node = child
+            best = (check_score(word), -position)
+            if best > node.best:
+                node.best = best
+                node.word = word
+        self.finalize(self.root)
+
+    def finalize(self, node):
+        """子を best が大きい順のリストにして、best を下から集計する"""
+        if not node.children:
+            node.children = []
+            return node.best
+        for child in node.children.values():
+            self.finalize(child)
+        node.children = sorted(node.children.items(), reverse=True,
+                               key=lambda item: item[1].best)
+        node.best = node.children[0][1].best
+        return node.best
+
+    def search(self, word):
+        """wordの一部を使って作れる、一番スコアが高い単語を返す
+
+        Args:
+            word (str): 探したい文字列
+
+        Returns:
+            str: 一番スコアが高いアナグラム。見つからなければ空文字列
+        """
+        counts = [word.count(ALPHABET[letter]) for letter in self.letter_order]
+        depth_limit = len(self.letter_order)
+        best = (-1, 0)
+        answer = ""
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if node.best <= best:
+                continue
+            if depth == depth_limit:
+                best = node.best
+                answer = node.word
+                continue
+            limit = counts[depth]
+            # best が大きい子から先に取り出されるように、逆順に積む
+            for count, child in reversed(node.children):
+                if count <= limit and child.best > best:
+                    stack.append((child, depth + 1))
+        return answer
+
+    def search_many(self, words):
+        return [self.search(word) for word in words]
+
+
+def benchmark(data_files=("small", "medium", "large")):
+    """search_word(Counterのリスト)とトライ木の速さを比べる
+
+    Returns:
+        list[Tuple(str, str, float, float)]: (データ, 方法, 辞書を作る時間, 探索時間)
+    """
+    dictionary = get_dictionary()
+    builders = [("counter", get_counted_dictionary),
+                ("trie", LetterCountTrie)]
+    indexes = []
+    for name, builder in builders:
+        start_time = time.perf_counter()
+        indexes.append((name, builder(dictionary),
+                       time.perf_counter() - start_time))
+
+    results = []
+    for data_file in data_files:
+        data = get_data(data_file + ".txt")
+        answers = {}
+        for name, index, build_time in indexes:
+            start_time = time.perf_counter()
+            answers[name] = [search_anagram(d, index) for d in data]
+            search_time = time.perf_counter() - start_time
+            results.append((data_file, name, build_time, search_time))
+            print(f"{data_file} {name}: build {build_time:.3f}s, search {search_time:.3f}s")
+        scores = {name: sum(map(check_score, res))
+                  for name, res in answers.items()}
+        assert len(set(scores.values())) == 1, scores
+    return results
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    benchmark()
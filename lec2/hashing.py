@@ -0,0 +1,168 @@
+import os
+import random
+import sys
+import time
+import zlib
+from pathlib import Path
+
+# How to use:
+#
+# $ python3 lec2/hashing.py    # ハッシュ関数ごとに、チェインの長さの分布と速さを比べる
+#
+# q1/hash_tables.py や q4/cache.py の HashTable には hash_function=fnv1a のように渡せる。
+# どの関数も素数の表を使わないので、import してすぐに使える。
+
+MASK_64 = (1 << 64) - 1
+FNV_OFFSET_BASIS = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+# xxHash64 で使われている素数
+PRIME_1 = 0x9E3779B185EBCA87
+PRIME_2 = 0xC2B2AE3D27D4EB4F
+
+
+def fnv1a(key):
+    """FNV-1a (64bit)。1byte ずつ xor して掛ける
+
+    Tests:
+    >>> fnv1a("")
+    14695981039346656037
+    >>> fnv1a("abc") != fnv1a("cba")
+    True
+    """
+    hash = FNV_OFFSET_BASIS
+    for byte in key.encode():
+        hash = ((hash ^ byte) * FNV_PRIME) & MASK_64
+    return hash
+
+
+def fast_hash(key):
+    """CRC32 を使うハッシュ関数。計算は zlib (C) の中で終わるので一番速い
+
+    32bit しかないが、バケットの数が数億にならなければ十分散らばる。
+    ただし seed を変えても衝突するキーの組は同じなので、わざと衝突させられるのには弱い。
+
+    Tests:
+    >>> fast_hash("abc")
+    891568578
+    >>> fast_hash("abc") != fast_hash("cba")
+    True
+    """
+    return zlib.crc32(key.encode())
+
+
+def keyed_hash(key, seed):
+    """seed 付きの xxHash 風のハッシュ関数。キーを int.from_bytes で1つの整数にして、8byte ずつ混ぜる
+
+    Tests:
+    >>> keyed_hash("abc", 0) == keyed_hash("abc", 0)
+    True
+    >>> len({keyed_hash("abc", 0), keyed_hash("cba", 0), keyed_hash("abc", 1)})
+    3
+    >>> keyed_hash("a", 0) != keyed_hash("a\\0", 0)
+    True
+    """
+    data = key.encode()
+    hash = (seed ^ (PRIME_1 * (len(data) + 1))) & MASK_64
+    value = int.from_bytes(data, "little")
+    while value:
+        hash = ((hash ^ (value & MASK_64)) * PRIME_1) & MASK_64
+        hash ^= hash >> 29
+        value >>= 64
+    hash = (hash * PRIME_2) & MASK_64
+    return hash ^ (hash >> 32)
+
+
+def make_seeded_hash(seed=None):
+    """ランダムな seed を決めた keyed_hash を返す
+
+    seed がわからないとハッシュ値が予想できないので、わざと同じバケットに入るキーを送りつけられにくい。
+
+    Tests:
+    >>> make_seeded_hash(1)("abc") == keyed_hash("abc", 1)
+    True
+    """
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "little")
+
+    def seeded_hash(key):
+        return keyed_hash(key, seed)
+    return seeded_hash
+
+
+HASH_FUNCTIONS = {
+    "fnv1a": fnv1a,
+    "fast": fast_hash,
+    "seeded": make_seeded_hash(),
+}
+
+
+def chain_stats(hash_function, keys, bucket_size):
+    """keys を bucket_size 個のバケットに入れた時の偏りを調べる
+
+    Returns:
+        dict: distinct_hashes (ハッシュ値の種類), max_chain (一番長いチェイン),
+              mean_probe (入っているキーを探す時に見る Item の数の平均。理想は 1 + 負荷率/2),
+              empty_ratio (空のバケットの割合)
+
+    Tests:
+    >>> stats = chain_stats(len, ["a", "b", "cc"], 7)
+    >>> stats["distinct_hashes"], stats["max_chain"], stats["mean_probe"]
+    (2, 2, 1.3333333333333333)
+    """
+    chains = [0] * bucket_size
+    hashes = set()
+    for key in keys:
+        hash = hash_function(key)
+        hashes.add(hash)
+        chains[hash % bucket_size] += 1
+    return {
+        "distinct_hashes": len(hashes),
+        "max_chain": max(chains),
+        # 長さ c のチェインのキーを全部探すと 1 + 2 + ... + c 個見る
+        "mean_probe": sum(c * (c + 1) // 2 for c in chains) / max(len(keys), 1),
+        "empty_ratio": chains.count(0) / bucket_size,
+    }
+
+
+def throughput(hash_function, keys):
+    """1秒あたりに計算できるハッシュ値の数"""
+    begin = time.perf_counter()
+    for key in keys:
+        hash_function(key)
+    return len(keys) / (time.perf_counter() - begin)
+
+
+def get_key_sets():
+    """比べるキーの集合: performance_test と同じ数字のキー、英単語、アナグラム、長いキー"""
+    random.seed(0)
+    numbers = list({str(random.randint(0, 100000000)) for _ in range(100000)})
+    words_file = Path(__file__).resolve().parent.parent / Path("lec1/anagrams/words.txt")
+    with open(words_file) as f:
+        words = list({line.strip() for line in f})
+    anagrams = list({"".join(random.sample("abcdefghij", 10))
+                    for _ in range(50000)})
+    urls = ["https://example.com/page/%d?q=%d" % (i, i * 7) for i in range(50000)]
+    return {"numbers": numbers, "words": words, "anagrams": anagrams, "urls": urls}
+
+
+def main():
+    sys.path.append(str(Path(__file__).resolve().parent / Path("q1")))
+    from hash_tables import calculate_hash
+
+    hash_functions = {"prime (q1)": calculate_hash, **HASH_FUNCTIONS}
+    for set_name, keys in get_key_sets().items():
+        # 負荷率 50% になるバケットサイズ(素数でなくても偏らないかを見るために偶数にする)
+        bucket_size = len(keys) * 2
+        print(f"{set_name}: {len(keys)} keys, {bucket_size} buckets")
+        for name, hash_function in hash_functions.items():
+            stats = chain_stats(hash_function, keys, bucket_size)
+            print(f"  {name:>10}: distinct {stats['distinct_hashes']:>6}, "
+                  f"max chain {stats['max_chain']:>5}, mean probe {stats['mean_probe']:8.2f}, "
+                  f"empty {stats['empty_ratio']:.3f}, "
+                  f"{throughput(hash_function, keys) / 1e6:.2f}M hashes/s")
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
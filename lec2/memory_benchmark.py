@@ -0,0 +1,115 @@
+import contextlib
+import gc
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# How to use:
+#
+# $ python3 lec2/memory_benchmark.py            # 100 万個のキーで、1要素あたりのメモリを比べる
+# $ python3 lec2/memory_benchmark.py 100000     # キーの数を変える
+#
+# キーと値の文字列は測る前に作っておくので、数字に入るのはハッシュテーブルが作ったもの
+# (Item、バケット、配列)だけ。ハッシュ関数は速い fast を使う。
+
+sys.path.append(str(Path(__file__).resolve().parent / Path("q1")))
+sys.path.append(str(Path(__file__).resolve().parent / Path("q4")))
+import cache  # noqa: E402
+import hash_tables  # noqa: E402
+from compact_cache import CompactCache  # noqa: E402
+from compact_hash_table import CompactHashTable  # noqa: E402
+from hashing import fast_hash  # noqa: E402
+from open_addressing import OpenAddressingHashTable  # noqa: E402
+
+
+class DictItem:
+    """__slots__ を付ける前の q1 の Item(1つずつ __dict__ を持つ)"""
+
+    def __init__(self, key, value, next):
+        self.key = key
+        self.value = value
+        self.next = next
+
+
+class DictCacheItem:
+    """__slots__ を付ける前の q4 の Item"""
+
+    def __init__(self, key, value, next, older_cache, newer_cache, expires_at=None, weight=0):
+        self.key = key
+        self.value = value
+        self.next = next
+        self.older_cache = older_cache
+        self.newer_cache = newer_cache
+        self.expires_at = expires_at
+        self.weight = weight
+        self.timer_slot = None
+        self.timer_prev = None
+        self.timer_next = None
+
+
+@contextlib.contextmanager
+def item_class(module, cls):
+    """module の HashTable が作る Item を、しばらく cls にする"""
+    original = module.Item
+    module.Item = cls
+    try:
+        yield
+    finally:
+        module.Item = original
+
+
+class DictTable:
+    """比較用の Python の dict"""
+
+    def __init__(self):
+        self.items = {}
+
+    def put(self, key, value):
+        self.items[key] = value
+
+
+LAYOUTS = {
+    "dict (reference)": (DictTable, None),
+    "q1 HashTable, __dict__ Item": (lambda: hash_tables.HashTable(hash_function=fast_hash),
+                                    (hash_tables, DictItem)),
+    "q1 HashTable, __slots__ Item": (lambda: hash_tables.HashTable(hash_function=fast_hash), None),
+    "q1 CompactHashTable": (lambda: CompactHashTable(fast_hash), None),
+    "q1 OpenAddressingHashTable": (lambda: OpenAddressingHashTable(fast_hash), None),
+    "q4 HashTable, __dict__ Item": (lambda: cache.HashTable(max_size=None, hash_function=fast_hash),
+                                    (cache, DictCacheItem)),
+    "q4 HashTable, __slots__ Item": (lambda: cache.HashTable(max_size=None, hash_function=fast_hash),
+                                     None),
+    "q4 CompactCache": (lambda: CompactCache(max_size=None, hash_function=fast_hash), None),
+}
+
+
+def measure(table_class, keys):
+    """keys を全部 put した時に table が使っているメモリ(byte)と、かかった時間"""
+    gc.collect()
+    tracemalloc.start()
+    begin = time.perf_counter()
+    table = table_class()
+    for key in keys:
+        table.put(key, key)
+    elapsed = time.perf_counter() - begin
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table
+    return memory, elapsed
+
+
+def main(count):
+    keys = ["key%d" % i for i in range(count)]
+    print(f"{count} keys")
+    for name, (table_class, patch) in LAYOUTS.items():
+        with contextlib.ExitStack() as stack:
+            if patch:
+                stack.enter_context(item_class(*patch))
+            memory, elapsed = measure(table_class, keys)
+        print(f"  {name:<30} {memory / count:7.1f} bytes/entry, "
+              f"{memory / 1024 / 1024:7.1f}MB, put {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 1000000)
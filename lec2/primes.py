@@ -0,0 +1,155 @@
+import bisect
+import itertools
+import threading
+import time
+from array import array
+from math import isqrt
+
+# How to use:
+#
+# >>> from primes import next_prime, first_primes
+# >>> next_prime(100)   # バケットサイズに使う、100 より大きい最小の素数
+# 101
+#
+# 素数は必要になった時に必要な分だけ区間篩(segmented sieve)で求めて、array にためておく。
+# import しただけでは何も計算しない。
+
+# 一度に篩にかける区間の長さ。bytearray 1つ分のメモリしか使わない
+SEGMENT_SIZE = 1 << 18
+
+
+def sieve_segment(low, high, base_primes):
+    """[low, high) の素数のリストを返す
+
+    Args:
+        base_primes (Iterable[int]): isqrt(high - 1) 以下の素数を全部含む、昇順の素数
+
+    Tests:
+    >>> sieve_segment(10, 30, [2, 3, 5])
+    [11, 13, 17, 19, 23, 29]
+    >>> sieve_segment(0, 10, [2, 3])
+    [2, 3, 5, 7]
+    """
+    if high <= low:
+        return []
+    flags = bytearray([1]) * (high - low)
+    for prime in base_primes:
+        if prime * prime >= high:
+            break
+        # low 以上で最初の prime の倍数から消す(prime 自身は残す)
+        start = max(prime * prime, -(-low // prime) * prime)
+        flags[start - low::prime] = bytes(len(range(start - low, high - low, prime)))
+    for i in range(low, min(2, high)):
+        flags[i - low] = 0
+    return list(itertools.compress(range(low, high), flags))
+
+
+class PrimeTable:
+    """limit 未満の素数を全部、昇順に array('I') で持つ表。足りなくなったら区間篩で伸ばす
+
+    ConcurrentHashTable のセグメントから同時に使われるので、表を伸ばす所は lock を持ってから行う。
+    一度 primes に入れた array は書き換えない。extend は新しい array を作って、できあがってから
+    primes を差し替え、その後で limit を進める。なので読む側は lock を持たずに、limit を見てから
+    primes を1回だけ読めば、その limit までの素数が全部入った array を使える。
+
+    Attributes:
+        primes (array[int]): limit 未満の素数。書き換えずに、伸ばす時は差し替える
+        limit (int): ここまでは篩にかけ終わっている
+        lock (threading.Lock): extend で使う
+
+    Tests:
+    >>> table = PrimeTable()
+    >>> list(table.first(5)[:5])
+    [2, 3, 5, 7, 11]
+    >>> table.next_prime(96), table.next_prime(97), table.next_prime(104729)
+    (97, 101, 104743)
+    >>> table.next_prime(10 ** 12)  # 表を 10**12 まで伸ばさずに、その先だけ篩にかける
+    1000000000039
+    """
+
+    def __init__(self):
+        self.primes = array("I")
+        self.limit = 2
+        self.lock = threading.Lock()
+
+    def extend(self, limit):
+        """limit 未満の素数を全部 self.primes に入れる"""
+        if self.limit >= limit:
+            return
+        with self.lock:
+            # 待っている間に他のスレッドが伸ばしたかもしれないので、lock を持ってから見直す
+            if self.limit >= limit:
+                return
+            # 読んでいる途中の array を書き換えないように、コピーを伸ばしてから差し替える
+            primes = array("I", self.primes)
+            high = self.limit
+            while high < limit:
+                # 篩うのに使う素数は isqrt(high - 1) まであればよいので、次の high は high ** 2 まで
+                low, high = high, min(limit, high + SEGMENT_SIZE, high * high)
+                primes.extend(sieve_segment(low, high, primes))
+            self.primes = primes
+            self.limit = high
+
+    def first(self, count):
+        """最初の count 個以上の素数が入った array を返す(コピーしないので書き換えないこと)"""
+        primes = self.primes
+        while len(primes) < count:
+            self.extend(self.limit * 2)
+            primes = self.primes
+        return primes
+
+    def next_prime(self, n):
+        """n より大きい最小の素数"""
+        if n + 1 < self.limit:
+            primes = self.primes  # limit を見た後に1回だけ読む
+            index = bisect.bisect_right(primes, n)
+            if index < len(primes):
+                return primes[index]
+        # 表より先は、n の後ろの区間だけを篩にかける。表は isqrt(区間の最後) まであればよい
+        # 素数の間隔は平均 log n くらいなので、短い区間から始めて、見つからなければ倍にしていく
+        low = max(n + 1, 2)
+        width = 64
+        while True:
+            high = low + width
+            self.extend(isqrt(high) + 1)
+            found = sieve_segment(low, high, self.primes)
+            if found:
+                return found[0]
+            low = high
+            width = min(width * 2, SEGMENT_SIZE)
+
+
+prime_table = PrimeTable()
+
+
+def next_prime(n):
+    """n より大きい最小の素数。バケットサイズを決めるのに使う
+
+    Tests:
+    >>> next_prime(0), next_prime(2), next_prime(200)
+    (2, 3, 211)
+    """
+    return prime_table.next_prime(n)
+
+
+def first_primes(count):
+    """最初の count 個以上の素数が入った array を返す。calculate_hash で使う
+
+    Tests:
+    >>> primes = first_primes(10000)
+    >>> len(primes) >= 10000, primes[9999]
+    (True, 104729)
+    """
+    return prime_table.first(count)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    table = PrimeTable()
+    begin = time.perf_counter()
+    table.first(10000)
+    print("first 10000 primes: %.6fs" % (time.perf_counter() - begin))
+    begin = time.perf_counter()
+    print("next prime after 3000000: %d, %.6fs" %
+          (table.next_prime(3000000), time.perf_counter() - begin))
@@ -0,0 +1,376 @@
+import random
+import sys
+import time
+from bisect import bisect_left
+
+from hash_tables import HashTable, functional_test, performance_test, HASH_FUNCTIONS
+
+# How to use:
+#
+# $ python3 lec2/q1/btree.py           # functional_test, btree_test, range_test と、BTree で performance_test
+# $ python3 lec2/q1/btree.py range     # range_test だけ(HashTable と点の検索・範囲の検索の速さを比べる)
+# $ python3 lec2/q1/hash_tables.py btree   # performance_test を BTree で動かす
+#
+# >>> tree = BTree()
+# >>> tree.put("apple", 1)
+# >>> list(tree.scan("a", "b"))    # "a" 以上 "b" 未満のキーを順番に
+
+
+class Node:
+    """B木の節。keys は昇順で、children[i] には keys[i - 1] と keys[i] の間のキーが入っている
+
+    Attributes:
+        keys (list[str]): キー
+        values (list): keys[i] の値が values[i]
+        children (list[Node] | None): 子。葉なら None
+    """
+    __slots__ = ("keys", "values", "children")
+
+    def __init__(self, keys, values, children):
+        self.keys = keys
+        self.values = values
+        self.children = children
+
+
+class BTree:
+    """HashTable と同じ put/get/delete/size に、範囲の検索(scan)と順番通りの列挙(items)を足したB木
+
+    節には degree - 1 個以上 2 * degree - 1 個以下のキーを入れる(根だけは 0 個以上)。
+    全部の葉が同じ深さなので、どの操作も O(log N) で、ハッシュテーブルの再ハッシュのように
+    1回だけ急に遅くなることがない。節の中は bisect で二分探索する。
+    put では満杯の節を、delete では最小の節を、下りる前に分けたり足したりしておくので、一度下りるだけで済む。
+
+    Attributes:
+        root (Node): 根
+        degree (int): 最小次数
+        item_count (int): 入っている要素の数
+
+    Tests:
+    >>> tree = BTree(degree=2)
+    >>> [tree.put(key, i) for i, key in enumerate("dbfaceg")].count(True)
+    7
+    >>> tree.get("c"), tree.get("z")
+    ((4, True), (None, False))
+    >>> [key for key, _ in tree.scan("b", "f")]
+    ['b', 'c', 'd', 'e']
+    >>> tree.delete("d"), tree.delete("d"), tree.size(), [key for key, _ in tree.items()]
+    (True, False, 6, ['a', 'b', 'c', 'e', 'f', 'g'])
+    """
+
+    def __init__(self, degree=32):
+        assert degree >= 2
+        self.degree = degree
+        self.root = Node([], [], None)
+        self.item_count = 0
+
+    def get(self, key):
+        """Get an item from the tree.
+
+        Return value: If the item is found, (the value of the item, True) is
+                        returned. Otherwise, (None, False) is returned.
+        """
+        assert type(key) == str
+        node = self.root
+        while True:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                return (node.values[i], True)
+            if node.children is None:
+                return (None, False)
+            node = node.children[i]
+
+    def split_child(self, parent, i):
+        """満杯の parent.children[i] を2つに分けて、真ん中のキーを parent に上げる"""
+        child = parent.children[i]
+        middle = self.degree - 1
+        right = Node(child.keys[middle + 1:], child.values[middle + 1:],
+                     None if child.children is None else child.children[middle + 1:])
+        parent.keys.insert(i, child.keys[middle])
+        parent.values.insert(i, child.values[middle])
+        parent.children.insert(i + 1, right)
+        del child.keys[middle:]
+        del child.values[middle:]
+        if child.children is not None:
+            del child.children[middle + 1:]
+
+    def put(self, key, value):
+        """Put an item to the tree. If the key already exists, the
+        corresponding value is updated to a new value.
+
+        Return value: True if a new item is added. False if the key already exists
+                        and the value is updated.
+        """
+        assert type(key) == str
+        max_keys = 2 * self.degree - 1
+        if len(self.root.keys) == max_keys:  # 根が満杯なら、根を分けて木を1段高くする
+            self.root = Node([], [], [self.root])
+            self.split_child(self.root, 0)
+        node = self.root
+        while True:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                node.values[i] = value
+                return False
+            if node.children is None:
+                node.keys.insert(i, key)
+                node.values.insert(i, value)
+                self.item_count += 1
+                return True
+            if len(node.children[i].keys) == max_keys:
+                self.split_child(node, i)
+                if key == node.keys[i]:
+                    node.values[i] = value
+                    return False
+                if key > node.keys[i]:
+                    i += 1
+            node = node.children[i]
+
+    def merge_children(self, node, i):
+        """node.children[i] に node.keys[i] と node.children[i + 1] をくっつける"""
+        left = node.children[i]
+        right = node.children.pop(i + 1)
+        left.keys.append(node.keys.pop(i))
+        left.values.append(node.values.pop(i))
+        left.keys.extend(right.keys)
+        left.values.extend(right.values)
+        if left.children is not None:
+            left.children.extend(right.children)
+
+    def fill_child(self, node, i):
+        """キーが degree - 1 個しかない node.children[i] に、隣から借りるかくっつけて1個増やす
+
+        Returns:
+            int: 次に下りる子の番号(左とくっつけた時だけ i - 1 になる)
+        """
+        child = node.children[i]
+        if i > 0 and len(node.children[i - 1].keys) >= self.degree:
+            left = node.children[i - 1]
+            child.keys.insert(0, node.keys[i - 1])
+            child.values.insert(0, node.values[i - 1])
+            node.keys[i - 1] = left.keys.pop()
+            node.values[i - 1] = left.values.pop()
+            if child.children is not None:
+                child.children.insert(0, left.children.pop())
+            return i
+        if i < len(node.keys) and len(node.children[i + 1].keys) >= self.degree:
+            right = node.children[i + 1]
+            child.keys.append(node.keys[i])
+            child.values.append(node.values[i])
+            node.keys[i] = right.keys.pop(0)
+            node.values[i] = right.values.pop(0)
+            if child.children is not None:
+                child.children.append(right.children.pop(0))
+            return i
+        if i < len(node.keys):
+            self.merge_children(node, i)
+            return i
+        self.merge_children(node, i - 1)
+        return i - 1
+
+    def delete(self, key):
+        """Delete an item from the tree.
+
+        消すキーが内側の節にあれば、左の部分木の一番大きいキー(か右の一番小さいキー)と入れ替えて、
+        それを葉から消す。
+
+        Return value: True if the item is found and deleted successfully. False
+                    otherwise.
+        """
+        assert type(key) == str
+        node = self.root
+        deleted = False
+        while True:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                if node.children is None:
+                    del node.keys[i]
+                    del node.values[i]
+                    deleted = True
+                    break
+                left, right = node.children[i], node.children[i + 1]
+                if len(left.keys) >= self.degree:
+                    neighbor = left
+                    while neighbor.children is not None:
+                        neighbor = neighbor.children[-1]
+                    node.keys[i], node.values[i] = neighbor.keys[-1], neighbor.values[-1]
+                    key = neighbor.keys[-1]  # 入れ替えたキーを左の部分木から消す
+                    node = left
+                elif len(right.keys) >= self.degree:
+                    neighbor = right
+                    while neighbor.children is not None:
+                        neighbor = neighbor.children[0]
+                    node.keys[i], node.values[i] = neighbor.keys[0], neighbor.values[0]
+                    key = neighbor.keys[0]
+                    node = right
+                else:
+                    self.merge_children(node, i)
+                    node = left
+                continue
+            if node.children is None:
+                break
+            if len(node.children[i].keys) < self.degree:
+                i = self.fill_child(node, i)
+            node = node.children[i]
+        if not self.root.keys and self.root.children is not None:  # 根が空になったら木を1段低くする
+            self.root = self.root.children[0]
+        if deleted:
+            self.item_count -= 1
+        return deleted
+
+    def scan(self, low=None, high=None):
+        """low 以上 high 未満のキーの (key, value) を、キーの順に返す。None なら端まで
+
+        木をたどる途中の (節, 次に見るキーの番号) をスタックに積む。葉は bisect で終わりを探して、まとめて返す。
+        返している途中で put/delete してはいけない。
+        """
+        stack = []
+        node = self.root
+        while True:
+            i = 0 if low is None else bisect_left(node.keys, low)
+            stack.append((node, i))
+            if node.children is None:
+                break
+            node = node.children[i]
+        while stack:
+            node, i = stack.pop()
+            keys = node.keys
+            if node.children is None:
+                end = len(keys) if high is None else bisect_left(keys, high, i)
+                yield from zip(keys[i:end], node.values[i:end])
+                if end < len(keys):
+                    return
+                continue
+            if i == len(keys):
+                continue
+            if high is not None and keys[i] >= high:
+                return
+            yield keys[i], node.values[i]
+            stack.append((node, i + 1))
+            child = node.children[i + 1]
+            while True:  # 右の子の一番左の葉まで下りる
+                stack.append((child, 0))
+                if child.children is None:
+                    break
+                child = child.children[0]
+
+    def items(self):
+        """全部の (key, value) をキーの順に返す"""
+        return self.scan()
+
+    def size(self):
+        """Return the total number of items in the tree."""
+        return self.item_count
+
+    def check(self):
+        """B木の形が正しいか(キーの順番、節のキーの数、葉の深さ、要素の数)を確かめる"""
+        leaf_depths = set()
+
+        def walk(node, depth, low, high):
+            if node is not self.root:
+                assert self.degree - 1 <= len(node.keys) <= 2 * self.degree - 1
+            assert node.keys == sorted(node.keys) and len(node.keys) == len(node.values)
+            assert all((low is None or low < key) and (high is None or key < high)
+                       for key in node.keys)
+            if node.children is None:
+                leaf_depths.add(depth)
+                return len(node.keys)
+            assert len(node.children) == len(node.keys) + 1
+            bounds = [low] + node.keys + [high]
+            return len(node.keys) + sum(walk(child, depth + 1, bounds[i], bounds[i + 1])
+                                        for i, child in enumerate(node.children))
+
+        assert walk(self.root, 0, None, None) == self.item_count
+        assert len(leaf_depths) == 1
+
+
+def btree_test(operations=100000):
+    """ランダムな put/get/delete/scan を dict と比べ、ときどき木の形を確かめる"""
+    for degree in (2, 3, 32):
+        tree = BTree(degree)
+        expected = {}
+        random.seed(degree)
+        for i in range(operations):
+            key = str(random.randint(0, 2000))
+            operation = random.random()
+            if operation < 0.3:
+                assert tree.get(key) == ((expected[key], True) if key in expected else (None, False))
+            elif operation < 0.65:
+                assert tree.put(key, i) == (key not in expected)
+                expected[key] = i
+            elif operation < 0.99:
+                assert tree.delete(key) == (key in expected)
+                expected.pop(key, None)
+            else:
+                low, high = sorted([key, str(random.randint(0, 2000))])
+                assert list(tree.scan(low, high)) == sorted(
+                    (k, v) for k, v in expected.items() if low <= k < high)
+            if i % 1000 == 0:
+                tree.check()
+        tree.check()
+        assert list(tree.items()) == sorted(expected.items())
+        for key in list(expected):
+            assert tree.delete(key)
+        tree.check()
+        assert tree.size() == 0 and tree.root.children is None
+    print("B-tree tests passed!")
+
+
+def prefix_range(prefix):
+    """prefix で始まるキーの範囲 [low, high)"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def range_test(count=200000, hash_function=None):
+    """HashTable と BTree で、put・点の検索(get)・範囲の検索(先頭の数字で絞る scan)の速さを比べる
+
+    HashTable には範囲の検索がないので、全部の要素を見てから並べ替える。
+    """
+    random.seed(0)
+    keys = [str(random.randint(0, 100000000)) for _ in range(count)]
+    lookups = random.sample(keys, min(count, 100000))
+    prefixes = [str(random.randint(100, 999)) for _ in range(1000)]
+    hash_table = HashTable(hash_function=hash_function or HASH_FUNCTIONS["fast"])
+    tree = BTree()
+
+    def scan_hash_table(prefix):
+        low, high = prefix_range(prefix)
+        return sorted((key, value) for key, value in hash_table.items() if low <= key < high)
+
+    def scan_tree(prefix):
+        return list(tree.scan(*prefix_range(prefix)))
+
+    print(f"{count} keys       {'HashTable':>14} {'BTree':>14}")
+    results = {}
+    for name, table in (("HashTable", hash_table), ("BTree", tree)):
+        begin = time.perf_counter()
+        for key in keys:
+            table.put(key, key)
+        put = count / (time.perf_counter() - begin)
+        begin = time.perf_counter()
+        for key in lookups:
+            table.get(key)
+        get = len(lookups) / (time.perf_counter() - begin)
+        # HashTable の範囲の検索は1回で全部の要素を見るので、回数を減らす
+        scans = prefixes[:10] if table is hash_table else prefixes
+        scan = scan_hash_table if table is hash_table else scan_tree
+        begin = time.perf_counter()
+        found = [scan(prefix) for prefix in scans]
+        results[name] = (put, get, len(scans) / (time.perf_counter() - begin), found)
+    assert results["HashTable"][3] == results["BTree"][3][:10]
+    for index, label in enumerate(["put/s", "get/s", "range scans/s"]):
+        print(f"{label:<16} {results['HashTable'][index]:>14.0f} {results['BTree'][index]:>14.0f}")
+    print("(1回の範囲の検索で、平均 %.0f 個のキーが見つかる)" %
+          (sum(map(len, results["BTree"][3])) / len(prefixes)))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    options = sys.argv[1:]
+    if "range" in options:
+        range_test()
+        sys.exit()
+    functional_test(BTree)
+    btree_test()
+    range_test()
+    performance_test(BTree)
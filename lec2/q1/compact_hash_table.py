@@ -0,0 +1,200 @@
+import sys
+from array import array
+
+from hash_tables import functional_test, performance_test, HASH_FUNCTIONS, calculate_hash
+from hashing import MASK_64
+from primes import next_prime
+
+# How to use:
+#
+# $ python3 lec2/q1/compact_hash_table.py         # Item を作らない CompactHashTable を測る
+# $ python3 lec2/q1/compact_hash_table.py fast    # lec2/hashing.py のハッシュ関数(fnv1a, fast, seeded)を使う
+#
+# 1要素あたりのメモリは lec2/memory_benchmark.py で比べられる。
+
+EMPTY = -1  # 次の要素がない時の番号
+
+
+class CompactHashTable:
+    """HashTable と同じ put/get/delete/size を持つ、Item を作らないチェイン法のハッシュテーブル
+
+    要素を番号で表して、キー・値・ハッシュ値・次の要素の番号をそれぞれ1本の配列に並べる。
+    Item の next の代わりに next_index[i] に同じバケットの次の要素の番号を入れる。
+    番号とハッシュ値は array に入れるので、1要素あたり 8byte ずつで済む(Python の int を作らない)。
+    消した要素の番号は空き番号のリスト(next_index でつなぐ)に入れて、次に put した時に使い回す。
+    再ハッシュではハッシュ値を計算し直さず、要素も動かさずに、buckets と next_index だけを作り直す。
+
+    Attributes:
+        bucket_size (int): バケットの数
+        buckets (array[int]): バケットの最初の要素の番号。空なら EMPTY
+        next_index (array[int]): 同じバケットの次の要素の番号。空き番号では、次の空き番号
+        keys (list[str | None]): キー。空き番号は None
+        values (list): 値
+        hashes (array[int]): キーのハッシュ値(64bit)
+        free_index (int): 空き番号のリストの先頭。なければ EMPTY
+        item_count (int): 入っている要素の数
+
+    Tests:
+    >>> hash_table = CompactHashTable()
+    >>> hash_table.put("abc", 1), hash_table.put("cba", 2), hash_table.put("abc", 3)
+    (True, True, False)
+    >>> hash_table.get("abc"), hash_table.get("bca")
+    ((3, True), (None, False))
+    >>> hash_table.delete("abc"), hash_table.put("bca", 4), len(hash_table.keys)  # abc の番号を使い回す
+    (True, True, 2)
+    """
+
+    def __init__(self, hash_function=None):
+        self.hash_function = hash_function or calculate_hash
+        self.bucket_size = 97
+        self.buckets = array("q", [EMPTY]) * self.bucket_size
+        self.next_index = array("q")
+        self.keys = []
+        self.values = []
+        self.hashes = array("Q")
+        self.free_index = EMPTY
+        self.item_count = 0
+
+    def find_index(self, key, hash):
+        """key の要素の番号。なければ EMPTY"""
+        keys = self.keys
+        hashes = self.hashes
+        next_index = self.next_index
+        index = self.buckets[hash % self.bucket_size]
+        while index != EMPTY:
+            if hashes[index] == hash and keys[index] == key:
+                return index
+            index = next_index[index]
+        return EMPTY
+
+    def renewal_bucket(self):
+        """要素数がbucket_sizeの70%を超えたら拡張し、30%を下回っていたら縮小する
+
+        空き番号が要素数より多くなっていたら、配列を詰めてから作り直す。
+        """
+        if not (self.item_count >= self.bucket_size * 0.7 or
+                (self.item_count <= self.bucket_size * 0.3 and self.bucket_size > 97)):
+            return
+        if len(self.keys) > self.item_count * 2:
+            self.compact()
+        bucket_size = next_prime(max(self.item_count * 2, 96))
+        buckets = array("q", [EMPTY]) * bucket_size
+        next_index = self.next_index
+        for index, hash in enumerate(self.hashes):
+            if self.keys[index] is None:
+                continue
+            bucket_index = hash % bucket_size
+            next_index[index] = buckets[bucket_index]
+            buckets[bucket_index] = index
+        self.buckets = buckets
+        self.bucket_size = bucket_size
+
+    def compact(self):
+        """空き番号を無くして、入っている要素を前に詰める(要素の番号が変わる)"""
+        live = [index for index, key in enumerate(self.keys) if key is not None]
+        self.keys = [self.keys[index] for index in live]
+        self.values = [self.values[index] for index in live]
+        self.hashes = array("Q", (self.hashes[index] for index in live))
+        # next_index は renewal_bucket で作り直す
+        self.next_index = array("q", [EMPTY]) * len(live)
+        self.free_index = EMPTY
+
+    def put(self, key, value):
+        """Put an item to the hash table. If the key already exists, the
+        corresponding value is updated to a new value.
+
+        Return value: True if a new item is added. False if the key already exists
+                        and the value is updated.
+        """
+        assert type(key) == str
+        self.check_size()
+        hash = self.hash_function(key) & MASK_64
+        index = self.find_index(key, hash)
+        if index != EMPTY:
+            self.values[index] = value
+            return False
+        bucket_index = hash % self.bucket_size
+        if self.free_index != EMPTY:
+            index = self.free_index
+            self.free_index = self.next_index[index]
+            self.keys[index] = key
+            self.values[index] = value
+            self.hashes[index] = hash
+            self.next_index[index] = self.buckets[bucket_index]
+        else:
+            index = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+            self.hashes.append(hash)
+            self.next_index.append(self.buckets[bucket_index])
+        self.buckets[bucket_index] = index
+        self.item_count += 1
+        self.renewal_bucket()
+        return True
+
+    def get(self, key):
+        """Get an item from the hash table.
+
+        Return value: If the item is found, (the value of the item, True) is
+                        returned. Otherwise, (None, False) is returned.
+        """
+        assert type(key) == str
+        self.check_size()
+        index = self.find_index(key, self.hash_function(key) & MASK_64)
+        if index == EMPTY:
+            return (None, False)
+        return (self.values[index], True)
+
+    def delete(self, key):
+        """Delete an item from the hash table.
+
+        Return value: True if the item is found and deleted successfully. False
+                    otherwise.
+        """
+        assert type(key) == str
+        hash = self.hash_function(key) & MASK_64
+        bucket_index = hash % self.bucket_size
+        next_index = self.next_index
+        previous = EMPTY
+        index = self.buckets[bucket_index]
+        while index != EMPTY:
+            if self.hashes[index] == hash and self.keys[index] == key:
+                break
+            previous = index
+            index = next_index[index]
+        else:
+            return False
+        if previous == EMPTY:  # バケットの先頭だった時
+            self.buckets[bucket_index] = next_index[index]
+        else:
+            next_index[previous] = next_index[index]
+        self.keys[index] = None
+        self.values[index] = None
+        next_index[index] = self.free_index
+        self.free_index = index
+        self.item_count -= 1
+        self.renewal_bucket()
+        return True
+
+    def size(self):
+        """Return the total number of items in the hash table."""
+        return self.item_count
+
+    def check_size(self):
+        """HashTable.check_size と同じ条件"""
+        assert (self.bucket_size < 100 or
+                self.item_count >= self.bucket_size * 0.3)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    options = sys.argv[1:]
+    hash_function = None
+    for name in options:
+        hash_function = HASH_FUNCTIONS.get(name, hash_function)
+
+    def table_class():
+        return CompactHashTable(hash_function)
+    functional_test(table_class)
+    performance_test(table_class)
@@ -0,0 +1,251 @@
+import bisect
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+from hash_tables import HashTable, functional_test, HASH_FUNCTIONS, calculate_hash
+from primes import PrimeTable  # hash_tables が lec2 を sys.path に入れた後に import する
+
+# How to use:
+#
+# $ python3 lec2/q1/concurrent_hash_table.py         # 正しさのストレステストと、スレッド数を 1 から増やした時の速さ
+# $ python3 lec2/q1/concurrent_hash_table.py 8 fast  # 8 スレッドまで、lec2/hashing.py のハッシュ関数を使う
+#
+# 普通の CPython では GIL があるので、スレッドを増やしても速くならない(GIL が切り替わる分だけ遅くなる)。
+# free-threaded build (python3.13t など) で動かすと、セグメントが違えば本当に並列に動く。
+
+
+class ConcurrentHashTable:
+    """複数のスレッドから同時に使える HashTable
+
+    キーをハッシュ値でセグメントに分けて、セグメントごとに HashTable と Lock を1つずつ持つ(lock striping)。
+    違うセグメントのキーなら、別のスレッドが同時に put/get/delete できる。
+
+    再ハッシュ(renewal_bucket)は HashTable の中で buckets を取り替えたり、Item の next を付け替えたりするので、
+    途中の状態を他のスレッドが見ると、あるはずのキーが見つからなくなる。
+    そこで get も含めてセグメントの中は必ずそのセグメントの Lock を持って触る。
+    再ハッシュはセグメントごとに、そのセグメントの Lock を持っている間に終わるので、他のセグメントは止まらない。
+    全部のセグメントの Lock がいる時(size など)は、デッドロックしないように必ず番号の順に取る。
+
+    Attributes:
+        segments (list[HashTable]): セグメント
+        locks (list[threading.Lock]): segments[i] を守る Lock
+        hash_function (Callable[[str], int]): セグメントを選ぶのにも、セグメントの中でも使うハッシュ関数
+
+    Tests:
+    >>> hash_table = ConcurrentHashTable(segment_count=4)
+    >>> hash_table.put("abc", 1), hash_table.put("abc", 2), hash_table.get("abc")
+    (True, False, (2, True))
+    >>> hash_table.update("count", lambda value: (value or 0) + 1)
+    1
+    >>> hash_table.size(), hash_table.delete("abc"), hash_table.size()
+    (2, True, 1)
+    """
+
+    def __init__(self, segment_count=16, hash_function=None, incremental=False):
+        self.hash_function = hash_function or calculate_hash
+        self.segments = [HashTable(incremental, self.hash_function)
+                         for _ in range(segment_count)]
+        self.locks = [threading.Lock() for _ in range(segment_count)]
+
+    def segment_index(self, key):
+        # セグメントの中では hash % (素数のバケットサイズ) を使うので、ここでは上の方のビットを使って偏らないようにする
+        return (self.hash_function(key) >> 7) % len(self.segments)
+
+    def put(self, key, value):
+        """HashTable.put と同じ"""
+        index = self.segment_index(key)
+        with self.locks[index]:
+            return self.segments[index].put(key, value)
+
+    def get(self, key):
+        """HashTable.get と同じ"""
+        index = self.segment_index(key)
+        with self.locks[index]:
+            return self.segments[index].get(key)
+
+    def delete(self, key):
+        """HashTable.delete と同じ"""
+        index = self.segment_index(key)
+        with self.locks[index]:
+            return self.segments[index].delete(key)
+
+    def update(self, key, function):
+        """key の値を function(今の値) にして、新しい値を返す。key がなければ function(None)
+
+        get してから put すると、その間に他のスレッドが put した値を上書きしてしまうので、
+        カウンタのように前の値を使って書き換える時はこれを使う。
+        """
+        index = self.segment_index(key)
+        with self.locks[index]:
+            segment = self.segments[index]
+            value = function(segment.get(key)[0])
+            segment.put(key, value)
+            return value
+
+    def put_many(self, items):
+        """(key, value) をセグメントごとに分けて、セグメントごとに1回だけ Lock を取って put_many する
+
+        Returns:
+            int: 新しく増えた要素の数
+        """
+        groups = [[] for _ in self.segments]
+        for key, value in items:
+            groups[self.segment_index(key)].append((key, value))
+        added = 0
+        for index, group in enumerate(groups):
+            if group:
+                with self.locks[index]:
+                    added += self.segments[index].put_many(group)
+        return added
+
+    @contextlib.contextmanager
+    def lock_all(self):
+        """全部のセグメントの Lock を番号の順に取る"""
+        with contextlib.ExitStack() as stack:
+            for lock in self.locks:
+                stack.enter_context(lock)
+            yield
+
+    def size(self):
+        """全部のセグメントを止めて数えるので、ある瞬間の正確な要素数になる"""
+        with self.lock_all():
+            return sum(segment.size() for segment in self.segments)
+
+
+def worker_keys(thread_index, operations, key_space):
+    random.seed(thread_index)
+    # スレッドごとに違うキーを使うので、スレッドの中で dict と比べれば正しさがわかる
+    return [("t%d-%d" % (thread_index, random.randrange(key_space)), random.random())
+            for _ in range(operations)]
+
+
+def run_threads(target, thread_count):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(thread_count)]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - begin
+
+
+def stress_test(thread_count=8, operations=20000, hash_function=None):
+    """スレッドごとに自分のキーを put/get/delete して dict と比べ、全部のスレッドで同じカウンタを増やす"""
+    hash_table = ConcurrentHashTable(hash_function=hash_function)
+    references = [None] * thread_count
+    errors = []
+
+    def work(thread_index):
+        reference = {}
+        for key, rand in worker_keys(thread_index, operations, 1000):
+            if rand < 0.5:
+                if hash_table.put(key, rand) != (key not in reference):
+                    errors.append(("put", key))
+                reference[key] = rand
+            elif rand < 0.8:
+                expected = (reference[key], True) if key in reference else (None, False)
+                if hash_table.get(key) != expected:
+                    errors.append(("get", key))
+            else:
+                if hash_table.delete(key) != (key in reference):
+                    errors.append(("delete", key))
+                reference.pop(key, None)
+            hash_table.update("shared%d" % (int(rand * 100) % 10), lambda value: (value or 0) + 1)
+        references[thread_index] = reference
+
+    run_threads(work, thread_count)
+    assert not errors, errors[:10]
+    expected_size = sum(len(reference) for reference in references) + 10
+    assert hash_table.size() == expected_size, (hash_table.size(), expected_size)
+    for reference in references:
+        for key, value in reference.items():
+            assert hash_table.get(key) == (value, True)
+    total = sum(hash_table.get("shared%d" % i)[0] for i in range(10))
+    assert total == thread_count * operations, total
+    print("Stress tests passed! (%d threads)" % thread_count)
+
+
+def prime_table_test(thread_count=8, rounds=20):
+    """空の PrimeTable を、たくさんのスレッドから同時に伸ばしても、素数が重ならずに昇順のままか確かめる
+
+    セグメントの renewal_bucket は next_prime を、calculate_hash は first_primes を、Lock を持ったまま呼ぶが、
+    Lock はセグメントごとなので、共有の prime_table は別のセグメントから同時に伸ばされる。
+    """
+    expected = PrimeTable()
+    expected.extend(1 << 21)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # スレッドを細かく切り替えて、extend の途中で割り込まれやすくする
+    try:
+        for round in range(rounds):
+            table = PrimeTable()
+            barrier = threading.Barrier(thread_count)
+            errors = []
+
+            def work(thread_index):
+                rng = random.Random(round * thread_count + thread_index)
+                barrier.wait()
+                for _ in range(20):
+                    n = rng.randrange(1 << 20)
+                    answer = table.next_prime(n)
+                    index = bisect.bisect_right(expected.primes, n)
+                    if answer != expected.primes[index]:
+                        errors.append(("next_prime", n, answer))
+                    count = rng.randrange(1, 20000)
+                    if table.first(count)[count - 1] != expected.primes[count - 1]:
+                        errors.append(("first", count))
+
+            run_threads(work, thread_count)
+            assert not errors, errors[:10]
+            primes = table.primes
+            assert list(primes) == list(expected.primes[:len(primes)])
+            assert len(primes) == bisect.bisect_left(expected.primes, table.limit)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    print("Prime table tests passed! (%d threads)" % thread_count)
+
+
+def scaling_test(max_threads, operations=200000, hash_function=None):
+    """同じ数の操作(put 1 回と get 4 回の組)をスレッドで分けた時の速さを、セグメントの数ごとに比べる
+
+    segments 1 はテーブル全体を Lock 1つで守った時で、lock striping をしないとどうなるかの比較用。
+    """
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print("GIL %s, %d CPUs" % ("enabled" if gil else "disabled", os.cpu_count()))
+    thread_counts = sorted({1, *[2 ** i for i in range(max_threads.bit_length())], max_threads})
+    for segment_count in (1, 16):
+        base = None
+        for thread_count in thread_counts:
+            hash_table = ConcurrentHashTable(segment_count, hash_function)
+            count = operations // thread_count // 5
+            keys = [worker_keys(i, count, count) for i in range(thread_count)]
+
+            def work(thread_index):
+                for key, rand in keys[thread_index]:
+                    hash_table.put(key, rand)
+                    for _ in range(4):
+                        hash_table.get(key)
+
+            ops = count * 5 * thread_count / run_threads(work, thread_count)
+            base = base or ops
+            print("segments %2d, threads %2d: %10.0f ops/s (x%.2f)" %
+                  (segment_count, thread_count, ops, ops / base))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    options = sys.argv[1:]
+    hash_function = None
+    max_threads = os.cpu_count() or 1
+    for name in options:
+        hash_function = HASH_FUNCTIONS.get(name, hash_function)
+        if name.isdigit():
+            max_threads = int(name)
+    functional_test(lambda: ConcurrentHashTable(hash_function=hash_function))
+    stress_test(max(max_threads, 4), hash_function=hash_function)
+    prime_table_test(max(max_threads, 4))
+    scaling_test(max_threads, hash_function=hash_function)
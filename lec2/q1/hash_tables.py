@@ -1,7 +1,17 @@
+import contextlib
+import gc
+import itertools
+import json
 import random
+import resource
+import sys
 import time
-from math import sqrt
-import bisect
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from hashing import HASH_FUNCTIONS  # noqa: E402
+from primes import first_primes, next_prime  # noqa: E402
+from snapshot import read_snapshot, write_snapshot  # noqa: E402
 
 ###########################################################################
 #                                                                         #
@@ -17,41 +27,24 @@ def print_item(item, text=""):
     print(text, item.key, item.value, item.next)
 
 
-def primes():
-    """素数のジェネレータ"""
-    def integers_starting_from(n):
-        while True:
-            yield n
-            n += 1
+# 段階的な再ハッシュで、1回の操作ごとに移すバケットの数
+REHASH_STEP = 4
 
-    def is_prime(n):
-        if n < 2:
-            return False
-        elif n == 2:
-            return False
-        elif n % 2 == 0:
-            return False
-        sqrt_n = sqrt(n)
-        for i in range(3, int(sqrt_n+1), 2):
-            if n % i == 0:
-                return False
-        return True
-    yield 2
-    for n in integers_starting_from(3):
-        if is_prime(n):
-            yield n
 
+@contextlib.contextmanager
+def paused_gc():
+    """まとめて Item や結果を作る間だけ GC を止める
 
-many_primes = []
-c = 0
-print("start generate primes...")
-for i in primes():
-    many_primes.append(i)
-    c += 1
-    if c == 10000:
-        break
-print(many_primes[-1])
-print("end generate primes!")
+    オブジェクトが増えるたびに GC が全部の Item をたどって遅くなるのを防ぐ。
+    Item も結果のタプルも循環参照を作らないので、止めても消し忘れは起きない。
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
 def calculate_hash(key):
@@ -66,8 +59,8 @@ def calculate_hash(key):
     assert type(key) == str
     # Note: This is not a good hash function. Do you see why?
     hash = 0
-    for i, k in enumerate(key):
-        hash += many_primes[i] * ord(k)  # 素数×文字の数字
+    for prime, k in zip(first_primes(len(key)), key):
+        hash += prime * ord(k)  # 素数×文字の数字
     return hash
 
 
@@ -80,6 +73,8 @@ class Item:
         next (str) : The next item in the linked list. If this is the last item in the
         linked list, |next| is None.
     """
+    # __dict__ を作らないので、1つあたり 104byte が 64byte になる(Python 3.11)
+    __slots__ = ("key", "value", "next")
 
     def __init__(self, key, value, next):
         assert type(key) == str
@@ -88,6 +83,91 @@ class Item:
         self.next = next
 
 
+class HashTableStats:
+    """HashTable(stats=True) の時に集める数字
+
+    Attributes:
+        probe_histogram (list[int]): probe_histogram[n] は、get/put/get_many/put_many で Item を n 個比べた回数
+        lookups (int): get/put/get_many/put_many でキーを探した回数(delete は数えない)
+        collided_lookups (int): 違うキーの Item を1つ以上比べた回数
+        resizes (list[dict]): 再ハッシュ1回ごとの、何回目の操作か・前後のバケットサイズ・要素数・かかった秒数
+        load_factors (list[list]): SAMPLE_INTERVAL 回ごとの [何回目の操作か, 負荷率(item_count / bucket_size)]
+    """
+    SAMPLE_INTERVAL = 10000
+
+    def __init__(self):
+        self.probe_histogram = [0]
+        self.lookups = 0
+        self.collided_lookups = 0
+        self.resizes = []
+        self.load_factors = []
+
+    def record_lookup(self, probes, found, table):
+        while len(self.probe_histogram) <= probes:
+            self.probe_histogram.append(0)
+        self.probe_histogram[probes] += 1
+        self.lookups += 1
+        # 見つかった時は最後の1個が探していたキーなので、それより多く比べていたらぶつかっている
+        if probes > found:
+            self.collided_lookups += 1
+        if self.lookups % self.SAMPLE_INTERVAL == 0:
+            self.load_factors.append([self.lookups, table.item_count / table.bucket_size])
+
+    def record_resize(self, old_size, new_size, item_count, seconds):
+        self.resizes.append({"at": self.lookups, "old_size": old_size, "new_size": new_size,
+                             "item_count": item_count, "seconds": seconds})
+
+    def percentile(self, ratio):
+        """比べた Item の数の、小さい方から ratio の所"""
+        target = self.lookups * ratio
+        total = 0
+        for probes, count in enumerate(self.probe_histogram):
+            total += count
+            if total >= target:
+                return probes
+        return len(self.probe_histogram) - 1
+
+    def snapshot(self, table):
+        """集めた数字を JSON にできる dict にする
+
+        hash_collision_rate は、今入っているキーのうちハッシュ値(% bucket_size する前)が他のキーと同じものの割合。
+        同じハッシュ値のキーが2個あれば、2個とも数える。
+        これだけは全部のキーのハッシュ値を計算し直すので、呼んだ時に O(N) かかる。
+
+        Tests:
+        >>> hash_table = HashTable(hash_function=len, stats=True)
+        >>> hash_table.put_many([("a", 1), ("b", 2), ("cc", 3), ("ddd", 4)])
+        4
+        >>> snapshot = hash_table.stats_snapshot()
+        >>> snapshot["hash_collision_rate"], snapshot["lookups"]
+        (0.5, 4)
+        """
+        hashes = sorted(table.hash_function(key) for key, _ in table.items())
+        shared_keys = sum(count for count in (len(list(group)) for _, group in itertools.groupby(hashes))
+                          if count > 1)
+        seconds = [resize["seconds"] for resize in self.resizes]
+        return {
+            "hash_function": getattr(table.hash_function, "__name__", str(table.hash_function)),
+            "item_count": table.item_count,
+            "bucket_size": table.bucket_size,
+            "load_factor": table.item_count / table.bucket_size,
+            "lookups": self.lookups,
+            "mean_probe": sum(probes * count for probes, count in enumerate(self.probe_histogram))
+            / max(self.lookups, 1),
+            "p99_probe": self.percentile(0.99),
+            "max_probe": len(self.probe_histogram) - 1,
+            "probe_histogram": {probes: count for probes, count in enumerate(self.probe_histogram)
+                                if count},
+            "collision_rate": self.collided_lookups / max(self.lookups, 1),
+            "hash_collision_rate": shared_keys / max(len(hashes), 1),
+            "resize_count": len(self.resizes),
+            "resize_seconds_total": sum(seconds),
+            "resize_seconds_max": max(seconds, default=0),
+            "resizes": self.resizes,
+            "load_factors": self.load_factors,
+        }
+
+
 class HashTable:
     """The main data structure of the hash table that stores key - value pairs.
     The key must be a string. The value can be any type.
@@ -97,15 +177,29 @@ class HashTable:
     self.buckets(List[]): An array of the buckets. self.buckets[hash % self.bucket_size]
                     stores a linked list of items whose hash value is |hash|.
     self.item_count(int): The total number of items in the hash table.
+    self.hash_function(Callable[[str], int]): ハッシュ関数
+    self.old_buckets(List[]): 段階的な再ハッシュの途中の古いバケット。途中でなければ None
+    self.stats(HashTableStats): stats=True の時に集めた数字。stats=False なら None
     """
     # Initialize the hash table.
 
-    def __init__(self):
+    def __init__(self, incremental=False, hash_function=None, stats=False):
         # Set the initial bucket size to 97. A prime number is chosen to reduce
         # hash conflicts.
         self.bucket_size = 97
         self.buckets = [None] * self.bucket_size
         self.item_count = 0
+        # キーからハッシュ値を計算する関数。lec2/hashing.py の関数も渡せる
+        self.hash_function = hash_function or calculate_hash
+        # incremental なら、再ハッシュを一度にせずに少しずつ進める
+        self.incremental = incremental
+        # 再ハッシュの途中の古いバケット。途中でなければ None
+        self.old_buckets = None
+        # 古いバケットのうち、ここより前は新しいバケットに移し終わっている
+        self.rehash_index = 0
+        # stats=True の時だけ、find_item と resize が数字を記録する。
+        # stats=False なら、増えるのは find_item と resize の中の if 1回だけ
+        self.stats = HashTableStats() if stats else None
 
     def show_all_items(self):  # debug
         print(f"size: {self.bucket_size}, count: {self.item_count}: ", end="")
@@ -118,33 +212,120 @@ class HashTable:
         print()
 
     def renewal_bucket(self):
-        """要素数がbucket_sizeの70%を超えたら拡張し、30%を下回っていたら縮小する"""
+        """要素数がbucket_sizeの70%を超えたら拡張し、30%を下回っていたら縮小する
+
+        どちらも新しいバケットサイズは要素数の2倍にする(使用率50%)。ただし最初の 97 より小さくはしない。
+        (put_many で重複したキーが多いと、要素数がとても少ないまま縮小することがあるため)
+        incremental なら、ここでは新しいバケットを用意するだけで、要素は put/get/delete のたびに
+        少しずつ移す(rehash_step)。
+        """
         if self.item_count >= self.bucket_size * 0.7:
             min_new_bucket_size = self.item_count * 2
-        elif self.item_count <= self.bucket_size * 0.3:
-            min_new_bucket_size = self.item_count // 2
+        elif self.item_count <= self.bucket_size * 0.3 and self.bucket_size > 97:
+            # next_prime(96) が 97
+            min_new_bucket_size = max(self.item_count * 2, 96)
         else:
             return
 
-        # バケットサイズが大きくなりすぎたら、素数を使うのを諦めて奇数にする
-        if min_new_bucket_size > many_primes[-1]:
-            new_bucket_size = min_new_bucket_size if min_new_bucket_size % 2 == 0 else min_new_bucket_size + 1
-        else:
-            prime_index = bisect.bisect(many_primes, min_new_bucket_size) # 二分探索で探索
-            new_bucket_size = many_primes[prime_index]
+        # 二分探索・区間篩で、min_new_bucket_size より大きい最小の素数を探す
+        self.resize(next_prime(min_new_bucket_size), self.incremental)
+
+    def resize(self, new_bucket_size, incremental=False):
+        """バケットサイズを new_bucket_size にする。incremental なら要素はまだ移さない
 
-        # バケットを作り直す
-        new_buckets = [None] * new_bucket_size
-        for i in range(self.bucket_size):  # 元のバケットサイズ
-            item = self.buckets[i]
+        stats があれば、かかった時間を記録する(incremental なら移す前の準備の時間だけ)。
+        """
+        old_size = self.bucket_size
+        begin = time.perf_counter() if self.stats is not None else 0
+        # 前の再ハッシュが終わっていなければ、先に全部移してしまう
+        if self.old_buckets is not None:
+            self.finish_rehash()
+        self.old_buckets = self.buckets
+        self.rehash_index = 0
+        self.buckets = [None] * new_bucket_size
+        self.bucket_size = new_bucket_size
+        if not incremental:
+            self.finish_rehash()
+        if self.stats is not None:
+            self.stats.record_resize(old_size, new_bucket_size, self.item_count,
+                                     time.perf_counter() - begin)
+
+    def move_bucket(self, index):
+        """古いバケットの index 番目の Item を、新しいバケットに付け替える(Item は作り直さない)"""
+        item = self.old_buckets[index]
+        while item:
+            next_item = item.next
+            bucket_index = self.hash_function(item.key) % self.bucket_size
+            item.next = self.buckets[bucket_index]
+            self.buckets[bucket_index] = item
+            item = next_item
+        self.old_buckets[index] = None
+
+    def rehash_step(self):
+        """再ハッシュの途中なら、古いバケットを REHASH_STEP 個だけ新しいバケットに移す
+
+        Redis の dict と同じく、空のバケットは REHASH_STEP * 10 個まで読み飛ばす。
+        """
+        if self.old_buckets is None:
+            return
+        moved = 0
+        empty_visits = REHASH_STEP * 10
+        while moved < REHASH_STEP and self.rehash_index < len(self.old_buckets):
+            if self.old_buckets[self.rehash_index] is None:
+                empty_visits -= 1
+                if empty_visits == 0:
+                    break
+            else:
+                self.move_bucket(self.rehash_index)
+                moved += 1
+            self.rehash_index += 1
+        if self.rehash_index == len(self.old_buckets):
+            self.old_buckets = None
+
+    def finish_rehash(self):
+        for index in range(self.rehash_index, len(self.old_buckets)):
+            self.move_bucket(index)
+        self.old_buckets = None
+
+    def find_item(self, key, hash):
+        """key の Item を古いバケット、新しいバケットの順に探す。なければ None"""
+        if self.stats is not None:
+            return self.find_item_with_stats(key, hash)
+        if self.old_buckets is not None:
+            item = self.old_buckets[hash % len(self.old_buckets)]
             while item:
-                bucket_index = calculate_hash(item.key) % new_bucket_size
-                new_item = Item(item.key, item.value,
-                                new_buckets[bucket_index])
-                new_buckets[bucket_index] = new_item
+                if item.key == key:
+                    return item
                 item = item.next
-        self.buckets = new_buckets
-        self.bucket_size = new_bucket_size
+        item = self.buckets[hash % self.bucket_size]
+        while item:
+            if item.key == key:
+                return item
+            item = item.next
+        return None
+
+    def find_item_with_stats(self, key, hash):
+        """find_item と同じだが、比べた Item の数を self.stats に記録する"""
+        probes = 0
+        found = None
+        buckets_list = [self.buckets] if self.old_buckets is None else [self.old_buckets, self.buckets]
+        for buckets in buckets_list:
+            item = buckets[hash % len(buckets)]
+            while item:
+                probes += 1
+                if item.key == key:
+                    found = item
+                    break
+                item = item.next
+            if found:
+                break
+        self.stats.record_lookup(probes, found is not None, self)
+        return found
+
+    def stats_snapshot(self):
+        """stats=True の時に集めた数字の dict(json.dumps できる)"""
+        assert self.stats is not None, "HashTable(stats=True) で作ってください"
+        return self.stats.snapshot(self)
 
     def put(self, key, value):
         """Put an item to the hash table. If the key already exists, the
@@ -157,13 +338,14 @@ class HashTable:
         """
         assert type(key) == str
         self.check_size()  # Note: Don't remove this code.
-        bucket_index = calculate_hash(key) % self.bucket_size
-        item = self.buckets[bucket_index]
-        while item:
-            if item.key == key:
-                item.value = value
-                return False
-            item = item.next
+        self.rehash_step()
+        hash = self.hash_function(key)
+        item = self.find_item(key, hash)
+        if item:
+            item.value = value
+            return False
+        # 新しい Item は常に新しいバケットに入れる
+        bucket_index = hash % self.bucket_size
         new_item = Item(key, value, self.buckets[bucket_index])
         self.buckets[bucket_index] = new_item
         self.item_count += 1
@@ -179,12 +361,10 @@ class HashTable:
         """
         assert type(key) == str
         self.check_size()  # Note: Don't remove this code.
-        bucket_index = calculate_hash(key) % self.bucket_size
-        item = self.buckets[bucket_index]
-        while item:
-            if item.key == key:
-                return (item.value, True)
-            item = item.next
+        self.rehash_step()
+        item = self.find_item(key, self.hash_function(key))
+        if item:
+            return (item.value, True)
         return (None, False)
 
     def delete(self, key):
@@ -195,35 +375,155 @@ class HashTable:
                     otherwise.
         """
         assert type(key) == str
-        bucket_index = calculate_hash(key) % self.bucket_size
-        if self.buckets[bucket_index] is None:
+        self.rehash_step()
+        hash = self.hash_function(key)
+        deleted = False
+        if self.old_buckets is not None:
+            deleted = self.unlink(
+                self.old_buckets, hash % len(self.old_buckets), key)
+        if not deleted:
+            deleted = self.unlink(self.buckets, hash % self.bucket_size, key)
+        if not deleted:
             return False
-        item = self.buckets[bucket_index]  # 単方向リストの先頭を取り出してる
+        self.item_count -= 1
+        self.renewal_bucket()
+        return True
+
+    def unlink(self, buckets, bucket_index, key):
+        """buckets[bucket_index] の単方向リストから key の Item を外す。外したら True"""
+        if buckets[bucket_index] is None:
+            return False
+        item = buckets[bucket_index]  # 単方向リストの先頭を取り出してる
 
         if item.key == key:  # 消したいitemが単方向リストのトップの時
-            if item.next:
-                self.buckets[bucket_index] = item.next
-            else:
-                self.buckets[bucket_index] = None
-            self.item_count -= 1
-            self.renewal_bucket()
+            buckets[bucket_index] = item.next
             return True
 
         # 消したいitemが単方向リストの２番目以降の時
-        # メモ: itemにはself.buckets[bucket_index]の値が入っているものとして考える。(と考えてたけど違うかも)
+        # メモ: itemにはbuckets[bucket_index]の値が入っているものとして考える。(と考えてたけど違うかも)
         while item:
             # 消したいItemの一個前と一個後を繋ぐ
             if item.next and item.next.key == key:
-                if item.next and item.next.next:
-                    item.next = item.next.next
-                else:
-                    item.next = None
-                self.item_count -= 1
-                self.renewal_bucket()
+                item.next = item.next.next
                 return True
             item = item.next
         return False
 
+    def put_many(self, items):
+        """(key, value) をまとめて put する
+
+        最初に全部入るバケットサイズにしておき、途中では再ハッシュしない。
+        キーが重複していて思ったより要素が増えなかった時のために、最後に一度だけ renewal_bucket を呼ぶ。
+        入れている間は GC を止める(paused_gc)。
+
+        Args:
+            items (Iterable[Tuple[str, Any]]): 入れたい (key, value)
+
+        Returns:
+            int: 新しく増えた要素の数
+
+        Tests:
+        >>> hash_table = HashTable()
+        >>> hash_table.put_many([("a", 1), ("b", 2), ("a", 3)])
+        2
+        >>> hash_table.get_many(["a", "b", "c"])
+        [(3, True), (2, True), (None, False)]
+        >>> hash_table.put_many([("a", i) for i in range(10000)]), hash_table.bucket_size
+        (0, 97)
+        """
+        items = list(items)
+        self.check_size()  # Note: Don't remove this code.
+        if self.old_buckets is not None:
+            self.finish_rehash()
+        expected_count = self.item_count + len(items)
+        if expected_count >= self.bucket_size * 0.7:
+            self.resize(next_prime(expected_count * 2))
+
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        stats = self.stats
+        added = 0
+        with paused_gc():
+            for (key, value), hash in zip(items, map(self.hash_function, (key for key, _ in items))):
+                assert type(key) == str
+                bucket_index = hash % bucket_size
+                if stats is not None:
+                    # 比べた Item の数を記録するために find_item で探す
+                    item = self.find_item(key, hash)
+                else:
+                    item = buckets[bucket_index]
+                    while item and item.key != key:
+                        item = item.next
+                if item:
+                    item.value = value
+                else:
+                    buckets[bucket_index] = Item(key, value, buckets[bucket_index])
+                    added += 1
+        self.item_count += added
+        self.renewal_bucket()
+        return added
+
+    def get_many(self, keys):
+        """keys をまとめて get する。ハッシュ値は最初にまとめて計算する。結果を作る間は GC を止める
+
+        Returns:
+            list[Tuple[Any, bool]]: keys と同じ順番の (value, 見つかったか)
+        """
+        keys = list(keys)
+        self.check_size()  # Note: Don't remove this code.
+        if self.old_buckets is not None:
+            self.finish_rehash()
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        stats = self.stats
+        results = []
+        with paused_gc():
+            for key, hash in zip(keys, map(self.hash_function, keys)):
+                if stats is not None:
+                    item = self.find_item(key, hash)
+                else:
+                    item = buckets[hash % bucket_size]
+                    while item and item.key != key:
+                        item = item.next
+                results.append((item.value, True) if item else (None, False))
+        return results
+
+    def items(self):
+        """全部の (key, value) を返す。順番はバケットの順で、キーの順ではない"""
+        for buckets in (self.old_buckets or [], self.buckets):
+            for item in buckets:
+                while item:
+                    yield item.key, item.value
+                    item = item.next
+
+    def snapshot(self, path):
+        """全部の要素を path に書く(lec2/snapshot.py の形)。再起動した後に restore で読み込める
+
+        Returns:
+            int: 書いたファイルの大きさ(byte)
+
+        Tests:
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), "snapshot")
+        >>> hash_table = HashTable()
+        >>> _ = hash_table.put_many([("a", "1"), ("b", "2")])
+        >>> _ = hash_table.snapshot(path)
+        >>> restored = HashTable()
+        >>> restored.restore(path), restored.get_many(["a", "b"])
+        (2, [('1', True), ('2', True)])
+        """
+        items = list(self.items())
+        return write_snapshot(path, [key for key, _ in items], [value for _, value in items])
+
+    def restore(self, path):
+        """snapshot で書いたファイルを読んで、put_many で一度に入れる(再ハッシュは多くても1回)
+
+        Returns:
+            int: 新しく増えた要素の数
+        """
+        keys, values, _, _ = read_snapshot(path)
+        return self.put_many(zip(keys, values))
+
     def size(self):
         """Return the total number of items in the hash table.
 
@@ -243,9 +543,18 @@ class HashTable:
                 self.item_count >= self.bucket_size * 0.3)
 
 
+def peak_memory_mb():
+    """このプロセスの最大RSS(MB)。Linux は KB、macOS は byte で返ってくる"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
 # Test the functional behavior of the hash table.
-def functional_test():
-    hash_table = HashTable()
+def functional_test(table_class=None):
+    """table_class には HashTable と同じ put/get/delete/size を持つクラスを渡せる"""
+    hash_table = (table_class or HashTable)()
 
     assert hash_table.put("aaa", 1) == True
     assert hash_table.get("aaa") == (1, True)
@@ -309,7 +618,7 @@ def functional_test():
     print("Functional tests passed!")
 
 
-def performance_test():
+def performance_test(table_class=None, latencies=False):
     """Test the performance of the hash table.
 
     Your goal is to make the hash table work with mostly O(1).
@@ -319,21 +628,45 @@ def performance_test():
     1) implement rehashing (Hint: expand / shrink the hash table when the number of
     items in the hash table hits some threshold) and
     2) tweak the hash function (Hint: think about ways to reduce hash conflicts).
+
+    table_class には HashTable と同じ put/get/delete/size を持つクラスを渡せる。
+    latencies=True なら、1回の put/get の時間も測って p99 と最大を表示する。
+    put/get ごとに time.perf_counter() を2回呼ぶので、その分だけ各回の時間は長くなる。
     """
-    hash_table = HashTable()
+    hash_table = (table_class or HashTable)()
+
+    def timed(operation):
+        def timed_operation(*args):
+            op_begin = time.perf_counter()
+            operation(*args)
+            op_latencies.append(time.perf_counter() - op_begin)
+        return timed_operation
 
+    total_begin = time.time()
     for iteration in range(100):
         begin = time.time()
+        op_latencies = []  # 1回の put/get にかかった時間
+        put, get = hash_table.put, hash_table.get
+        if latencies:
+            put, get = timed(put), timed(get)
         random.seed(iteration)
         for i in range(10000):
             rand = random.randint(0, 100000000)
-            hash_table.put(str(rand), str(rand))
+            put(str(rand), str(rand))
         random.seed(iteration)
         for i in range(10000):
             rand = random.randint(0, 100000000)
-            hash_table.get(str(rand))
+            get(str(rand))
         end = time.time()
-        print("%d %.6f" % (iteration, end - begin))
+        if latencies:
+            op_latencies.sort()
+            print("%d %.6f p99 %.1fus max %.1fus" % (
+                iteration, end - begin, op_latencies[len(op_latencies) * 99 // 100] * 1e6,
+                op_latencies[-1] * 1e6))
+        else:
+            print("%d %.6f" % (iteration, end - begin))
+    print("total %.6f, peak memory %.1fMB" %
+          (time.time() - total_begin, peak_memory_mb()))
 
     for iteration in range(100):
         random.seed(iteration)
@@ -345,6 +678,105 @@ def performance_test():
     print("Performance tests passed!")
 
 
+def bulk_performance_test(table_class=None):
+    """performance_test と同じ 100 万個のキーを、1つずつ put/get した時と put_many/get_many した時で比べる"""
+    table_class = table_class or HashTable
+    keys = []
+    for iteration in range(100):
+        random.seed(iteration)
+        for i in range(10000):
+            keys.append(str(random.randint(0, 100000000)))
+    items = [(key, key) for key in keys]
+
+    hash_table = table_class()
+    begin = time.time()
+    for key, value in items:
+        hash_table.put(key, value)
+    put_time = time.time() - begin
+    begin = time.time()
+    for key in keys:
+        hash_table.get(key)
+    get_time = time.time() - begin
+
+    bulk_table = table_class()
+    begin = time.time()
+    bulk_table.put_many(items)
+    put_many_time = time.time() - begin
+    begin = time.time()
+    results = bulk_table.get_many(keys)
+    get_many_time = time.time() - begin
+
+    assert bulk_table.size() == hash_table.size()
+    assert results == [(key, True) for key in keys]
+    print("put: %.6f, put_many: %.6f (x%.1f)" %
+          (put_time, put_many_time, put_time / put_many_time))
+    print("get: %.6f, get_many: %.6f (x%.1f)" %
+          (get_time, get_many_time, get_time / get_many_time))
+    print("Bulk performance tests passed!")
+
+
+def stats_test(hash_functions=None, iterations=10, path=None):
+    """performance_test と同じキーを HashTable(stats=True) に入れて、ハッシュ関数ごとの数字を比べる
+
+    Args:
+        hash_functions (list): 比べるハッシュ関数。None なら calculate_hash と lec2/hashing.py の fast
+        iterations (int): performance_test の何回目までのキーを使うか(1回 10000 個)
+        path (str | None): 数字を JSON で書くファイル。None ならこのファイルの隣の hash_table_stats.json
+    """
+    hash_functions = hash_functions or [calculate_hash, HASH_FUNCTIONS["fast"]]
+    path = path or Path(__file__).resolve().parent / "hash_table_stats.json"
+    snapshots = []
+    for hash_function in hash_functions:
+        hash_table = HashTable(hash_function=hash_function, stats=True)
+        begin = time.time()
+        for iteration in range(iterations):
+            random.seed(iteration)
+            for i in range(10000):
+                rand = random.randint(0, 100000000)
+                hash_table.put(str(rand), str(rand))
+            random.seed(iteration)
+            for i in range(10000):
+                rand = random.randint(0, 100000000)
+                assert hash_table.get(str(rand)) == (str(rand), True)
+        elapsed = time.time() - begin
+        snapshot = hash_table.stats_snapshot()
+        snapshot["seconds"] = elapsed
+        snapshots.append(snapshot)
+        print("%s: %.2fs, probes mean %.2f p99 %d max %d, collision rate %.3f, "
+              "hash collision rate %.4f, %d resizes (total %.1fms, max %.1fms)" % (
+                  snapshot["hash_function"], elapsed, snapshot["mean_probe"],
+                  snapshot["p99_probe"], snapshot["max_probe"], snapshot["collision_rate"],
+                  snapshot["hash_collision_rate"], snapshot["resize_count"],
+                  snapshot["resize_seconds_total"] * 1000, snapshot["resize_seconds_max"] * 1000))
+    with open(path, "w") as f:
+        json.dump(snapshots, f, indent=1)
+    print("wrote", path)
+    print("Stats tests passed!")
+
+
 if __name__ == "__main__":
-    functional_test()
-    performance_test()
+    # $ python3 hash_tables.py incremental  で段階的な再ハッシュを使う
+    # $ python3 hash_tables.py latency      で1回の put/get の p99 と最大も表示する
+    # $ python3 hash_tables.py fast         で lec2/hashing.py のハッシュ関数(fnv1a, fast, seeded)を使う
+    # $ python3 hash_tables.py bulk         で put_many/get_many と1つずつの put/get を比べる
+    # $ python3 hash_tables.py btree        で HashTable の代わりに btree.py の BTree を測る
+    # $ python3 hash_tables.py stats        で calculate_hash と fast の探した長さ・衝突・再ハッシュの数字を比べる
+    #                                       (stats fnv1a のように書くと、calculate_hash と fnv1a を比べる)
+    options = sys.argv[1:]
+    hash_function = None
+    for name in options:
+        hash_function = HASH_FUNCTIONS.get(name, hash_function)
+
+    def table_class():
+        return HashTable(incremental="incremental" in options, hash_function=hash_function)
+    if "btree" in options:
+        # btree.py がこのファイルを import するので、ここで import する
+        from btree import BTree
+        table_class = BTree
+    functional_test(table_class)
+    if "stats" in options:
+        stats_test([calculate_hash, hash_function] if hash_function else None)
+    elif "bulk" in options:
+        bulk_performance_test(table_class)
+    else:
+        performance_test(table_class, latencies="latency" in options)
@@ -0,0 +1,188 @@
+import sys
+from array import array
+
+from hash_tables import HashTable, functional_test, performance_test, HASH_FUNCTIONS
+from hashing import MASK_64, fnv1a
+from primes import next_prime
+
+# How to use:
+#
+# $ python3 lec2/q1/open_addressing.py           # オープンアドレス法の HashTable を測る
+# $ python3 lec2/q1/open_addressing.py chained   # 比較用に、元の(チェイン法の) HashTable を測る
+# $ python3 lec2/q1/open_addressing.py fast      # lec2/hashing.py のハッシュ関数(fnv1a, fast, seeded)を使う
+#
+# performance_test の最後に、全体の時間と最大RSSが表示される。
+
+
+class OpenAddressingHashTable:
+    """HashTable と同じ put/get/delete/size を持つ、オープンアドレス法(線形探索)のハッシュテーブル
+
+    Item を作らずに、キー・値・ハッシュ値をそれぞれ1本の配列に並べて持つ。
+    ハッシュ値は array('Q') に入れるので、場所1つあたり 8byte で済む(Python の int を作らない)。
+    ぶつかったら隣の場所を順に見ていき、空いている場所(None)に入れる。
+    線形探索はハッシュ値が偏ると同じ所に要素が固まって(クラスタ)、探索がどんどん長くなる。
+    hash_tables.calculate_hash は数字だけのキーだと千数百種類の値にしかならないので、FNV-1a を使う。
+    削除は墓標(tombstone)を置かずに、後ろの要素を前に詰める(backward shift deletion)。
+
+    Attributes:
+        bucket_size (int): 場所の数
+        keys (list[str | None]): キー。空いている場所は None
+        values (list): 値
+        hashes (array[int]): キーのハッシュ値(64bit)。比較と再ハッシュで使い回す
+        hash_function (Callable[[str], int]): ハッシュ関数
+        item_count (int): 入っている要素の数
+
+    Tests:
+    >>> hash_table = OpenAddressingHashTable()
+    >>> hash_table.put("abc", 1), hash_table.put("cba", 2), hash_table.put("abc", 3)
+    (True, True, False)
+    >>> hash_table.get("abc"), hash_table.get("bca")
+    ((3, True), (None, False))
+    >>> hash_table.delete("abc"), hash_table.delete("abc"), hash_table.size()
+    (True, False, 1)
+    """
+
+    def __init__(self, hash_function=fnv1a):
+        self.hash_function = hash_function
+        self.bucket_size = 97
+        self.keys = [None] * self.bucket_size
+        self.values = [None] * self.bucket_size
+        self.hashes = array("Q", [0]) * self.bucket_size
+        self.item_count = 0
+
+    def find_index(self, key, hash):
+        """key がある場所か、なければ key を入れるべき空いている場所を返す"""
+        keys = self.keys
+        hashes = self.hashes
+        index = hash % self.bucket_size
+        while True:
+            k = keys[index]
+            if k is None or (hashes[index] == hash and k == key):
+                return index
+            index += 1
+            if index == self.bucket_size:
+                index = 0
+
+    def renewal_bucket(self):
+        """要素数がbucket_sizeの70%を超えたら拡張し、30%を下回っていたら縮小する
+
+        オープンアドレス法では要素数より場所が多くないといけないので、縮小する時も要素数の2倍にする。
+        """
+        if not (self.item_count >= self.bucket_size * 0.7 or
+                (self.item_count <= self.bucket_size * 0.3 and self.bucket_size > 97)):
+            return
+        new_bucket_size = next_prime(max(self.item_count * 2, 96))
+
+        old_keys, old_values, old_hashes = self.keys, self.values, self.hashes
+        self.bucket_size = new_bucket_size
+        self.keys = [None] * new_bucket_size
+        self.values = [None] * new_bucket_size
+        self.hashes = array("Q", [0]) * new_bucket_size
+        keys, values, hashes = self.keys, self.values, self.hashes
+        for key, value, hash in zip(old_keys, old_values, old_hashes):
+            if key is None:
+                continue
+            # 新しい表には同じキーがないので、空いている場所を探すだけでよい
+            index = hash % new_bucket_size
+            while keys[index] is not None:
+                index += 1
+                if index == new_bucket_size:
+                    index = 0
+            keys[index] = key
+            values[index] = value
+            hashes[index] = hash
+
+    def put(self, key, value):
+        """Put an item to the hash table. If the key already exists, the
+        corresponding value is updated to a new value.
+
+        Return value: True if a new item is added. False if the key already exists
+                        and the value is updated.
+        """
+        assert type(key) == str
+        self.check_size()
+        hash = self.hash_function(key) & MASK_64
+        index = self.find_index(key, hash)
+        if self.keys[index] is not None:
+            self.values[index] = value
+            return False
+        self.keys[index] = key
+        self.values[index] = value
+        self.hashes[index] = hash
+        self.item_count += 1
+        self.renewal_bucket()
+        return True
+
+    def get(self, key):
+        """Get an item from the hash table.
+
+        Return value: If the item is found, (the value of the item, True) is
+                        returned. Otherwise, (None, False) is returned.
+        """
+        assert type(key) == str
+        self.check_size()
+        index = self.find_index(key, self.hash_function(key) & MASK_64)
+        if self.keys[index] is None:
+            return (None, False)
+        return (self.values[index], True)
+
+    def delete(self, key):
+        """Delete an item from the hash table.
+
+        消した場所より後ろにある要素のうち、本来の場所(hash % bucket_size)から見て
+        空いた場所を飛び越えているものを前に詰める。こうすると墓標がいらない。
+
+        Return value: True if the item is found and deleted successfully. False
+                    otherwise.
+        """
+        assert type(key) == str
+        index = self.find_index(key, self.hash_function(key) & MASK_64)
+        if self.keys[index] is None:
+            return False
+        keys, values, hashes = self.keys, self.values, self.hashes
+        bucket_size = self.bucket_size
+        hole = index
+        while True:
+            index += 1
+            if index == bucket_size:
+                index = 0
+            if keys[index] is None:
+                break
+            home = hashes[index] % bucket_size
+            # home から index までの距離が hole から index までの距離以上なら、hole に詰めてよい
+            if (index - home) % bucket_size >= (index - hole) % bucket_size:
+                keys[hole] = keys[index]
+                values[hole] = values[index]
+                hashes[hole] = hashes[index]
+                hole = index
+        keys[hole] = None
+        values[hole] = None
+        hashes[hole] = 0
+        self.item_count -= 1
+        self.renewal_bucket()
+        return True
+
+    def size(self):
+        """Return the total number of items in the hash table."""
+        return self.item_count
+
+    def check_size(self):
+        """HashTable.check_size と同じ条件"""
+        assert (self.bucket_size < 100 or
+                self.item_count >= self.bucket_size * 0.3)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    options = sys.argv[1:]
+    hash_function = None
+    for name in options:
+        hash_function = HASH_FUNCTIONS.get(name, hash_function)
+
+    def table_class():
+        if "chained" in options:
+            return HashTable(hash_function=hash_function)
+        return OpenAddressingHashTable(hash_function or fnv1a)
+    functional_test(table_class)
+    performance_test(table_class)
@@ -0,0 +1,207 @@
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from cache import HashTable
+from policies import zipf_trace, scan_trace
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from hashing import HASH_FUNCTIONS  # noqa: E402
+
+# How to use:
+#
+# $ python3 lec2/q4/cache_benchmark.py                 # zipf, scan, loop のアクセス列で測る
+# $ python3 lec2/q4/cache_benchmark.py urls.txt        # 1行に1つ URL が書かれたファイルのアクセス列で測る
+# $ python3 lec2/q4/cache_benchmark.py fast            # lec2/hashing.py のハッシュ関数(fnv1a, fast, seeded)を使う
+#
+# アクセス列ごとに、次のものを表示する。
+#   - 1回の stack distance の計算から求めた、全部のキャッシュサイズの LRU のミス率の曲線
+#   - いくつかのキャッシュサイズで実際に cache.HashTable に流した時のヒット率、1秒あたりの操作数、メモリ
+
+
+def loop_trace(length, loop_size):
+    """0, 1, ..., loop_size - 1 を繰り返すアクセス列。LRU は loop_size 未満だと1回も当たらない
+
+    Tests:
+    >>> loop_trace(5, 2)
+    ['page0', 'page1', 'page0', 'page1', 'page0']
+    """
+    return ["page%d" % (i % loop_size) for i in range(length)]
+
+
+def file_trace(path):
+    """1行に1つ URL(キー)が書かれたファイルを読む。空行は飛ばす"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class FenwickTree:
+    """区間の和を O(log n) で求める木(Binary Indexed Tree)
+
+    Tests:
+    >>> tree = FenwickTree(8)
+    >>> tree.add(2, 1); tree.add(5, 1); tree.add(7, 1)
+    >>> tree.prefix_sum(5), tree.prefix_sum(8)
+    (2, 3)
+    """
+
+    def __init__(self, size):
+        self.tree = [0] * (size + 1)
+
+    def add(self, index, delta):
+        """index 番目(1から数える)に delta を足す"""
+        tree = self.tree
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index):
+        """1 番目から index 番目までの和"""
+        tree = self.tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+
+def stack_distances(trace):
+    """アクセスごとの LRU の stack distance(前に使ってから何種類のキーを使ったか + 1)を返す
+
+    初めてのアクセスは 0。大きさ C の LRU キャッシュで当たるのは、stack distance が 1 以上 C 以下のアクセス。
+    各キーが最後に使われた時刻に 1 を立てておくと、前に使った時刻より後の 1 の数が、その間に使われたキーの種類になる。
+    (Mattson の方法を Fenwick tree で O(n log n) にしたもの)
+
+    Tests:
+    >>> stack_distances(["a", "b", "a", "c", "b", "b"])
+    [0, 0, 2, 0, 3, 1]
+    """
+    tree = FenwickTree(len(trace))
+    last_access = {}
+    distances = []
+    for time, key in enumerate(trace, 1):
+        previous = last_access.get(key)
+        if previous is None:
+            distances.append(0)
+        else:
+            distances.append(tree.prefix_sum(time - 1) - tree.prefix_sum(previous) + 1)
+            tree.add(previous, -1)
+        tree.add(time, 1)
+        last_access[key] = time
+    return distances
+
+
+def miss_ratio_curve(trace, sizes):
+    """sizes のそれぞれのキャッシュサイズで、LRU のミス率を返す
+
+    Tests:
+    >>> miss_ratio_curve(loop_trace(100, 10), [5, 9, 10])
+    [1.0, 1.0, 0.1]
+    """
+    histogram = {}
+    for distance in stack_distances(trace):
+        histogram[distance] = histogram.get(distance, 0) + 1
+    curve = []
+    for size in sizes:
+        misses = sum(count for distance, count in histogram.items()
+                     if distance == 0 or distance > size)
+        curve.append(misses / len(trace))
+    return curve
+
+
+def replay(trace, max_size, measure_memory=False, hash_function=None):
+    """trace の順にキャッシュを get して、なければ put する
+
+    Returns:
+        tuple[float, float, float]: (ヒット率, 1秒あたりの get/put の数, キャッシュが使っているメモリ(MB))
+        メモリはキャッシュが作ったもの(Item とバケット)だけで、キーの文字列は trace と共有しているので入らない。
+        measure_memory が False の時、メモリは 0 にする(tracemalloc は遅いので、速さとは別に測る)
+
+    Tests:
+    >>> replay(loop_trace(100, 10), 10)[0]
+    0.9
+    """
+    if measure_memory:
+        tracemalloc.start()
+    cache = HashTable(max_size=max_size, hash_function=hash_function)
+    hits = 0
+    operations = 0
+    begin = time.perf_counter()
+    for key in trace:
+        _, found = cache.get(key)
+        operations += 1
+        if found:
+            hits += 1
+        else:
+            cache.put(key, key)
+            operations += 1
+    elapsed = time.perf_counter() - begin
+    memory = 0
+    if measure_memory:
+        memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+        tracemalloc.stop()
+    return hits / len(trace), operations / elapsed, memory
+
+
+def log_sizes(max_size, steps=16):
+    """1 から max_size までを、だいたい等比になるように steps 個に分けたキャッシュサイズ
+
+    Tests:
+    >>> log_sizes(1000, 4)
+    [1, 10, 100, 1000]
+    """
+    sizes = {round(max_size ** (i / (steps - 1))) for i in range(steps)}
+    return sorted(sizes)
+
+
+def print_curve(sizes, curve, width=50):
+    """ミス率の曲線を横棒で表示する"""
+    print("  %8s  %-6s" % ("size", "miss"))
+    for size, miss in zip(sizes, curve):
+        print("  %8d  %.3f  %s" % (size, miss, "#" * round(miss * width)))
+
+
+def benchmark(name, trace, hash_function=None):
+    keys = len(set(trace))
+    print(f"{name}: {len(trace)} accesses, {keys} keys")
+    sizes = log_sizes(keys)
+    begin = time.perf_counter()
+    curve = miss_ratio_curve(trace, sizes)
+    print("LRU miss ratio curve (stack distance, %.2fs)" % (time.perf_counter() - begin))
+    print_curve(sizes, curve)
+
+    print("  %8s  %8s  %8s  %10s  %8s" % ("size", "hit", "curve", "ops/s", "memory"))
+    replay_sizes = log_sizes(keys, 5)[1:]
+    for size, miss in zip(replay_sizes, miss_ratio_curve(trace, replay_sizes)):
+        hit_ratio, ops, _ = replay(trace, size, hash_function=hash_function)
+        _, _, memory = replay(trace, size, True, hash_function)
+        expected = 1 - miss
+        # cache.HashTable は LRU なので、stack distance から求めたヒット率と一致するはず
+        assert abs(hit_ratio - expected) < 1e-9, (size, hit_ratio, expected)
+        print("  %8d  %8.3f  %8.3f  %10.0f  %6.1fMB" % (size, hit_ratio, expected, ops, memory))
+    print()
+
+
+def main():
+    options = sys.argv[1:]
+    hash_function = None
+    for name in options:
+        hash_function = HASH_FUNCTIONS.get(name, hash_function)
+    paths = [name for name in options if name not in HASH_FUNCTIONS]
+    if paths:
+        traces = {path: file_trace(path) for path in paths}
+    else:
+        traces = {
+            "zipf": zipf_trace(200000, 20000),
+            "scan": scan_trace(zipf_trace(200000, 20000), 5000, 20000),
+            "loop": loop_trace(200000, 5000),
+        }
+    for name, trace in traces.items():
+        benchmark(name, trace, hash_function)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
@@ -0,0 +1,244 @@
+from array import array
+
+from cache import calculate_hash, functional_test, lru_test, trace_test
+from hashing import MASK_64
+from primes import next_prime
+
+# How to use:
+#
+# $ python3 lec2/q4/compact_cache.py    # cache.py と同じテストを CompactCache で動かす
+#
+# 1要素あたりのメモリは lec2/memory_benchmark.py で比べられる。
+
+EMPTY = -1  # 次の要素がない時の番号
+
+
+class CompactCache:
+    """cache.HashTable と同じ LRU キャッシュを、Item を作らずに並列な配列で持つもの
+
+    要素を番号で表し、Item の next/older_cache/newer_cache の代わりに
+    next_index/older_index/newer_index に番号を入れる。番号は array に入れるので1つ 8byte で済む。
+    消したり追い出したりした要素の番号は空き番号のリストに入れて使い回すので、
+    配列は max_size より長くならない。max_size が None なら、cache.HashTable と同じく数で追い出さない。
+    max_size が 0 なら、cache.HashTable と同じく put しても何も入れない。
+    policy/TTL/max_bytes は使えない(max_size 個までの LRU だけ)。
+
+    Attributes:
+        buckets (array[int]): バケットの最初の要素の番号。空なら EMPTY
+        next_index (array[int]): 同じバケットの次の要素の番号。空き番号では、次の空き番号
+        older_index, newer_index (array[int]): 1つ古い・新しいキャッシュの番号
+        keys (list[str | None]), values (list), hashes (array[int]): キー・値・ハッシュ値
+        latest_index, oldest_index (int): 一番新しい・古いキャッシュの番号。空なら EMPTY
+        free_index (int): 空き番号のリストの先頭。なければ EMPTY
+
+    Tests:
+    >>> cache = CompactCache(max_size=2)
+    >>> cache.put("a", 1), cache.put("b", 2), cache.get("a"), cache.put("c", 3)
+    (True, True, (1, True), True)
+    >>> cache.cache_keys(), len(cache.keys)  # b が追い出されて、b の番号に c が入った
+    (['c', 'a'], 2)
+    >>> cache = CompactCache(max_size=None)
+    >>> all(cache.put(str(i), i) for i in range(1000)), cache.size(), cache.get("0")
+    (True, 1000, (0, True))
+    >>> cache = CompactCache(max_size=0)
+    >>> cache.put("a", 1), cache.get("a"), cache.size()
+    (True, (None, False), 0)
+    """
+
+    def __init__(self, max_size=10, hash_function=None):
+        self.hash_function = hash_function or calculate_hash
+        self.max_size = max_size
+        self.bucket_size = 97
+        self.buckets = array("q", [EMPTY]) * self.bucket_size
+        self.next_index = array("q")
+        self.older_index = array("q")
+        self.newer_index = array("q")
+        self.keys = []
+        self.values = []
+        self.hashes = array("Q")
+        self.latest_index = EMPTY
+        self.oldest_index = EMPTY
+        self.free_index = EMPTY
+        self.item_count = 0
+
+    def find_index(self, key, hash):
+        """key の要素の番号。なければ EMPTY"""
+        keys = self.keys
+        hashes = self.hashes
+        next_index = self.next_index
+        index = self.buckets[hash % self.bucket_size]
+        while index != EMPTY:
+            if hashes[index] == hash and keys[index] == key:
+                return index
+            index = next_index[index]
+        return EMPTY
+
+    def renewal_bucket(self):
+        """要素数がbucket_sizeの70%を超えたら拡張し、30%を下回っていたら縮小する
+
+        空き番号が要素数より多くなっていたら、配列を詰めてから作り直す。
+        """
+        if not (self.item_count >= self.bucket_size * 0.7 or
+                (self.item_count <= self.bucket_size * 0.3 and self.bucket_size > 97)):
+            return
+        if len(self.keys) > self.item_count * 2:
+            self.compact()
+        bucket_size = next_prime(max(self.item_count * 2, 96))
+        buckets = array("q", [EMPTY]) * bucket_size
+        next_index = self.next_index
+        for index, hash in enumerate(self.hashes):
+            if self.keys[index] is None:
+                continue
+            bucket_index = hash % bucket_size
+            next_index[index] = buckets[bucket_index]
+            buckets[bucket_index] = index
+        self.buckets = buckets
+        self.bucket_size = bucket_size
+
+    def compact(self):
+        """古い順に番号を 0, 1, 2, ... に付け直して、空き番号を無くす"""
+        order = []
+        index = self.oldest_index
+        while index != EMPTY:
+            order.append(index)
+            index = self.newer_index[index]
+        count = len(order)
+        self.keys = [self.keys[index] for index in order]
+        self.values = [self.values[index] for index in order]
+        self.hashes = array("Q", (self.hashes[index] for index in order))
+        # 古い順に並べたので、1つ古いのは番号が1つ小さいもの
+        self.older_index = array("q", range(-1, count - 1))
+        self.newer_index = array("q", range(1, count + 1))
+        if count:
+            self.newer_index[-1] = EMPTY
+        self.next_index = array("q", [EMPTY]) * count  # renewal_bucket で作り直す
+        self.oldest_index = 0 if count else EMPTY
+        self.latest_index = count - 1 if count else EMPTY
+        self.free_index = EMPTY
+
+    def unlink_cache(self, index):
+        """index をキャッシュの双方向リストから外す"""
+        older = self.older_index[index]
+        newer = self.newer_index[index]
+        if newer != EMPTY:
+            self.older_index[newer] = older
+        else:  # 自分が一番新しかった時
+            self.latest_index = older
+        if older != EMPTY:
+            self.newer_index[older] = newer
+        else:  # 自分が一番古かった時
+            self.oldest_index = newer
+
+    def push_latest(self, index):
+        """index をキャッシュの双方向リストの一番新しい所に入れる"""
+        self.older_index[index] = self.latest_index
+        self.newer_index[index] = EMPTY
+        if self.latest_index != EMPTY:
+            self.newer_index[self.latest_index] = index
+        else:  # 一番最初の要素の時
+            self.oldest_index = index
+        self.latest_index = index
+
+    def remove(self, index):
+        """index をバケットとキャッシュの双方向リストから外して、空き番号にする"""
+        bucket_index = self.hashes[index] % self.bucket_size
+        next_index = self.next_index
+        if self.buckets[bucket_index] == index:  # バケットの先頭だった時
+            self.buckets[bucket_index] = next_index[index]
+        else:
+            previous = self.buckets[bucket_index]
+            while next_index[previous] != index:
+                previous = next_index[previous]
+            next_index[previous] = next_index[index]
+        self.unlink_cache(index)
+        self.keys[index] = None
+        self.values[index] = None
+        next_index[index] = self.free_index
+        self.free_index = index
+        self.item_count -= 1
+
+    def put(self, key, value):
+        """cache.HashTable.put と同じ。満杯なら先に一番古いキャッシュを消して、その番号を使う"""
+        assert type(key) == str
+        self.check_size()
+        hash = self.hash_function(key) & MASK_64
+        index = self.find_index(key, hash)
+        if index != EMPTY:
+            self.values[index] = value
+            if index != self.latest_index:
+                self.unlink_cache(index)
+                self.push_latest(index)
+            return False
+        if self.max_size is not None and self.item_count >= self.max_size:
+            if self.item_count == 0:
+                return True  # max_size が 0 なら何も入れない
+            self.remove(self.oldest_index)
+        bucket_index = hash % self.bucket_size
+        if self.free_index != EMPTY:
+            index = self.free_index
+            self.free_index = self.next_index[index]
+            self.keys[index] = key
+            self.values[index] = value
+            self.hashes[index] = hash
+            self.next_index[index] = self.buckets[bucket_index]
+        else:
+            index = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+            self.hashes.append(hash)
+            self.next_index.append(self.buckets[bucket_index])
+            self.older_index.append(EMPTY)
+            self.newer_index.append(EMPTY)
+        self.buckets[bucket_index] = index
+        self.push_latest(index)
+        self.item_count += 1
+        self.renewal_bucket()
+        return True
+
+    def get(self, key):
+        """cache.HashTable.get と同じ。見つかった要素は一番新しいキャッシュになる"""
+        assert type(key) == str
+        self.check_size()
+        index = self.find_index(key, self.hash_function(key) & MASK_64)
+        if index == EMPTY:
+            return (None, False)
+        if index != self.latest_index:
+            self.unlink_cache(index)
+            self.push_latest(index)
+        return (self.values[index], True)
+
+    def delete(self, key):
+        """cache.HashTable.delete と同じ"""
+        assert type(key) == str
+        index = self.find_index(key, self.hash_function(key) & MASK_64)
+        if index == EMPTY:
+            return False
+        self.remove(index)
+        self.renewal_bucket()
+        return True
+
+    def cache_keys(self):
+        """新しい順のキーのリスト"""
+        keys = []
+        index = self.latest_index
+        while index != EMPTY:
+            keys.append(self.keys[index])
+            index = self.older_index[index]
+        return keys
+
+    def size(self):
+        """Return the total number of items in the hash table."""
+        return self.item_count
+
+    def check_size(self):
+        """cache.HashTable.check_size と同じ条件"""
+        assert (self.bucket_size < 100 or
+                self.item_count >= self.bucket_size * 0.3)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    functional_test(CompactCache)
+    lru_test(CompactCache)
+    trace_test(table_class=CompactCache)
@@ -0,0 +1,481 @@
+import bisect
+import itertools
+import random
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+from cache import HashTable
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from hashing import keyed_hash  # noqa: E402
+
+# How to use:
+#
+# $ python3 lec2/q4/policies.py    # Zipf + スキャンのアクセス列で、追い出し方ごとのヒット率を比べる
+#
+# >>> cache = HashTable(policy=LFUPolicy(100))
+#
+# 追い出し方(policy)は次のメソッドを持つ。どれも O(1)。
+#     capacity       キャッシュに入れておける要素の数
+#     insert(key)    新しいキーを入れる。追い出すキーを返す(なければ None、key 自身なら key を入れない)
+#     touch(key)     キャッシュにあるキーが使われた
+#     miss(key)      キャッシュにないキーを探した
+#     remove(key)    キーを消した
+#
+# キャッシュの中身(値)は HashTable が持つ。policy はキーの順番や回数だけを覚えておく。
+#
+# q1 と cache.py は dict を使わずにハッシュテーブルを作るのが課題だったが、policy の中は dict と
+# OrderedDict で書いている。OrderedDict は「ハッシュテーブル + 双方向リスト」で、cache.py の HashTable が
+# LRU のために持っているものと同じ作りなので、どの操作も O(1) なのは変わらない。
+# 2Q や ARC は 3〜4 本、TinyLFU は 3 本のリストを使うので、HashTable と同じリストを policy ごとに書き直す
+# 代わりに、比べたいもの(追い出すキーの選び方とヒット率)だけを書けるようにした。
+# ヒット率はどちらで書いても同じで、速さとメモリは HashTable 単体の方を測っている(readme.md)。
+
+
+class LRUPolicy:
+    """一番長く使われていないキーを追い出す
+
+    Tests:
+    >>> policy = LRUPolicy(2)
+    >>> policy.insert("a"), policy.insert("b")
+    (None, None)
+    >>> policy.touch("a")
+    >>> policy.insert("c")
+    'b'
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.keys = OrderedDict()  # 古い順
+
+    def insert(self, key):
+        self.keys[key] = None
+        if len(self.keys) > self.capacity:
+            return self.keys.popitem(last=False)[0]
+        return None
+
+    def touch(self, key):
+        self.keys.move_to_end(key)
+
+    def miss(self, key):
+        pass
+
+    def remove(self, key):
+        self.keys.pop(key, None)
+
+
+class LFUPolicy:
+    """使われた回数が一番少ないキーを追い出す。同じ回数なら一番長く使われていないキー
+
+    回数ごとにキーの OrderedDict を持つ(frequency buckets)。キーがあるバケットの回数を
+    lower/higher で小さい順の双方向リストにつないでおき、min_count はその先頭なので、どの操作も O(1)。
+
+    Tests:
+    >>> policy = LFUPolicy(2)
+    >>> policy.insert("a"), policy.insert("b")
+    (None, None)
+    >>> policy.touch("a"); policy.touch("b"); policy.touch("b")
+    >>> policy.insert("c")
+    'a'
+    >>> policy.insert("d")  # c と d は 1 回ずつなので、先に入った c
+    'c'
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}  # key -> 使われた回数
+        self.buckets = {}  # 回数 -> その回数のキー(古い順)
+        self.lower = {}  # 回数 -> キーがあるバケットのうち、1つ小さい回数(なければ None)
+        self.higher = {}  # 回数 -> キーがあるバケットのうち、1つ大きい回数(なければ None)
+        self.min_count = None  # 一番小さい回数。空なら None
+
+    def add_to_bucket(self, key, count, lower):
+        """key を count 回のバケットに入れる。バケットがなければ、lower 回のバケットのすぐ後ろ(None なら先頭)に作る"""
+        self.counts[key] = count
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = OrderedDict()
+            higher = self.min_count if lower is None else self.higher[lower]
+            self.lower[count] = lower
+            self.higher[count] = higher
+            if lower is None:
+                self.min_count = count
+            else:
+                self.higher[lower] = count
+            if higher is not None:
+                self.lower[higher] = count
+        bucket[key] = None
+
+    def remove_from_bucket(self, key):
+        """key をバケットから出す。バケットが空になったら、回数のリストからも外す"""
+        count = self.counts.pop(key)
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            lower = self.lower.pop(count)
+            higher = self.higher.pop(count)
+            if lower is None:
+                self.min_count = higher
+            else:
+                self.higher[lower] = higher
+            if higher is not None:
+                self.lower[higher] = lower
+        return count
+
+    def insert(self, key):
+        victim = None
+        if len(self.counts) >= self.capacity:
+            victim = next(iter(self.buckets[self.min_count]))
+            self.remove_from_bucket(victim)
+        self.add_to_bucket(key, 1, None)  # 1 回が一番小さいので、作るなら先頭
+        return victim
+
+    def touch(self, key):
+        count = self.counts[key]
+        # count 回のバケットが key だけなら、出した時に消えるので、その1つ前の後ろに count + 1 回を作る
+        lower = count if len(self.buckets[count]) > 1 else self.lower[count]
+        self.remove_from_bucket(key)
+        self.add_to_bucket(key, count + 1, lower)
+
+    def miss(self, key):
+        pass
+
+    def remove(self, key):
+        if key not in self.counts:
+            return
+        self.remove_from_bucket(key)
+
+
+class TwoQPolicy:
+    """2Q (Johnson & Shasha)。1回しか使われないキー(スキャン)で、よく使うキーが追い出されないようにする
+
+    新しいキーはまず FIFO の a1in に入る。a1in から追い出されたキーは a1out に名前だけ残しておき、
+    a1out にあるキーがもう一度来たら、よく使うキーとして LRU の am に入れる。
+
+    Tests:
+    >>> policy = TwoQPolicy(4)
+    >>> [policy.insert(key) for key in "abcd"]
+    [None, None, None, None]
+    >>> policy.insert("e")  # a1in の一番古い a が a1out に移る
+    'a'
+    >>> policy.insert("a") is not None, "a" in policy.am
+    (True, True)
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_size = max(1, capacity // 4)
+        self.out_size = max(1, capacity // 2)
+        self.a1in = OrderedDict()  # 1回だけ使われたキー(古い順)
+        self.a1out = OrderedDict()  # a1in から追い出されたキーの名前だけ
+        self.am = OrderedDict()  # 2回以上使われたキー(古い順)
+
+    def insert(self, key):
+        if key in self.a1out:
+            del self.a1out[key]
+            self.am[key] = None
+        else:
+            self.a1in[key] = None
+        if len(self.a1in) + len(self.am) <= self.capacity:
+            return None
+        if len(self.a1in) > self.in_size or not self.am:
+            victim = self.a1in.popitem(last=False)[0]
+            self.a1out[victim] = None
+            if len(self.a1out) > self.out_size:
+                self.a1out.popitem(last=False)
+            return victim
+        return self.am.popitem(last=False)[0]
+
+    def touch(self, key):
+        if key in self.am:
+            self.am.move_to_end(key)
+
+    def miss(self, key):
+        pass
+
+    def remove(self, key):
+        self.a1in.pop(key, None)
+        self.am.pop(key, None)
+
+
+class ARCPolicy:
+    """ARC (Megiddo & Modha)。最近使ったキー(t1)とよく使うキー(t2)の割合を、アクセスに合わせて変える
+
+    t1/t2 から追い出したキーは名前だけ b1/b2 に残す。b1 にあるキーがまた来たら t1 を大きく、
+    b2 にあるキーがまた来たら t2 を大きくする(target_t1 が t1 の目標の大きさ)。
+
+    Tests:
+    >>> policy = ARCPolicy(2)
+    >>> policy.insert("a"), policy.insert("b")
+    (None, None)
+    >>> policy.touch("a")  # a は t2 に移る
+    >>> policy.insert("c")
+    'b'
+    >>> policy.insert("b")  # b1 にあったので t1 の目標が大きくなり、t2 の a が追い出される
+    'a'
+    >>> policy.target_t1
+    1
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.target_t1 = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+
+    def replace(self, key):
+        if self.t1 and (len(self.t1) > self.target_t1 or
+                        (key in self.b2 and len(self.t1) == self.target_t1)):
+            victim = self.t1.popitem(last=False)[0]
+            self.b1[victim] = None
+        else:
+            victim = self.t2.popitem(last=False)[0]
+            self.b2[victim] = None
+        return victim
+
+    def is_full(self):
+        return len(self.t1) + len(self.t2) >= self.capacity
+
+    def insert(self, key):
+        victim = None
+        if key in self.b1:
+            self.target_t1 = min(self.capacity, self.target_t1 +
+                                 max(len(self.b2) // len(self.b1), 1))
+            if self.is_full():
+                victim = self.replace(key)
+            del self.b1[key]
+            self.t2[key] = None
+            return victim
+        if key in self.b2:
+            self.target_t1 = max(0, self.target_t1 -
+                                 max(len(self.b1) // len(self.b2), 1))
+            if self.is_full():
+                victim = self.replace(key)
+            del self.b2[key]
+            self.t2[key] = None
+            return victim
+
+        if len(self.t1) + len(self.b1) >= self.capacity:
+            if len(self.t1) < self.capacity:
+                self.b1.popitem(last=False)
+                if self.is_full():
+                    victim = self.replace(key)
+            else:
+                victim = self.t1.popitem(last=False)[0]
+        elif len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= self.capacity:
+            if len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= 2 * self.capacity:
+                self.b2.popitem(last=False)
+            if self.is_full():
+                victim = self.replace(key)
+        self.t1[key] = None
+        return victim
+
+    def touch(self, key):
+        if key in self.t1:
+            del self.t1[key]
+            self.t2[key] = None
+        else:
+            self.t2.move_to_end(key)
+
+    def miss(self, key):
+        pass
+
+    def remove(self, key):
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+
+
+class CountMinSketch:
+    """キーごとの回数を、少しのメモリでだいたい数える(多めに数えることはあっても少なくはならない)
+
+    sample_size 回数えたら全部の回数を半分にして、昔よく使われたキーがいつまでも強くならないようにする。
+
+    Tests:
+    >>> sketch = CountMinSketch(64)
+    >>> for _ in range(5): sketch.add("a")
+    >>> sketch.estimate("a"), sketch.estimate("b")
+    (5, 0)
+    """
+
+    MAX_COUNT = 15
+
+    def __init__(self, width, depth=4, sample_size=None):
+        self.width = width
+        self.depth = depth
+        self.rows = [bytearray(width) for _ in range(depth)]
+        self.sample_size = sample_size or width * 10
+        self.additions = 0
+
+    def indexes(self, key):
+        # 1つの 64bit のハッシュ値を2つに分けて、depth 個の場所を作る(Kirsch-Mitzenmacher)
+        hash = keyed_hash(key, 0)
+        low, high = hash & 0xffffffff, (hash >> 32) | 1
+        return [(low + i * high) % self.width for i in range(self.depth)]
+
+    def add(self, key):
+        for row, index in zip(self.rows, self.indexes(key)):
+            if row[index] < self.MAX_COUNT:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self.indexes(key)))
+
+    def reset(self):
+        for row in self.rows:
+            row[:] = bytes(count >> 1 for count in row)
+        self.additions //= 2
+
+
+class TinyLFUPolicy:
+    """W-TinyLFU。小さい LRU の窓(1%)と、SLRU の本体(probation 20% / protected 80%)を持つ
+
+    窓から追い出されたキーは、本体の一番古いキーと CountMinSketch で数えた回数を比べて、
+    多い方だけを本体に残す。1回しか使われないキーが本体に入れないので、スキャンに強い。
+
+    Tests:
+    >>> policy = TinyLFUPolicy(10)
+    >>> [policy.insert(str(i)) for i in range(10)].count(None)
+    10
+    >>> for _ in range(3): policy.touch("5")
+    >>> policy.insert("new")  # 窓から追い出された "9" は、本体の "0" と回数が同じなので入れない
+    '9'
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.window_size = max(1, capacity // 100)
+        self.main_size = capacity - self.window_size
+        self.protected_size = self.main_size * 8 // 10
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.sketch = CountMinSketch(max(16, capacity))
+
+    def insert(self, key):
+        self.sketch.add(key)
+        self.window[key] = None
+        if len(self.window) <= self.window_size:
+            return None
+        candidate = self.window.popitem(last=False)[0]
+        if len(self.probation) + len(self.protected) < self.main_size:
+            self.probation[candidate] = None
+            return None
+        if self.main_size == 0:
+            return candidate
+        victims = self.probation or self.protected
+        victim = next(iter(victims))
+        if self.sketch.estimate(candidate) <= self.sketch.estimate(victim):
+            return candidate
+        del victims[victim]
+        self.probation[candidate] = None
+        return victim
+
+    def touch(self, key):
+        self.sketch.add(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                demoted = self.protected.popitem(last=False)[0]
+                self.probation[demoted] = None
+        else:
+            self.protected.move_to_end(key)
+
+    def miss(self, key):
+        self.sketch.add(key)
+
+    def remove(self, key):
+        for keys in (self.window, self.probation, self.protected):
+            keys.pop(key, None)
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "2q": TwoQPolicy,
+    "arc": ARCPolicy,
+    "tinylfu": TinyLFUPolicy,
+}
+
+
+def zipf_trace(length, key_count, alpha=1.0, seed=0):
+    """key_count 種類のページを、順位の alpha 乗に反比例する確率で選んだアクセス列
+
+    Tests:
+    >>> trace = zipf_trace(1000, 100)
+    >>> len(trace), trace.count("page0") > trace.count("page99")
+    (1000, True)
+    """
+    rng = random.Random(seed)
+    cumulative = list(itertools.accumulate(
+        1 / (rank + 1) ** alpha for rank in range(key_count)))
+    # ページの番号を並べ替えて、番号の小さいページほどよく使われるという偏りを無くす。
+    # ただし page0 だけは一番よく使われるページにしておく(テストで使う)
+    pages = list(range(key_count))
+    rng.shuffle(pages)
+    pages[pages.index(0)], pages[0] = pages[0], 0
+    return ["page%d" % pages[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+            for _ in range(length)]
+
+
+def scan_trace(trace, scan_length, every, seed=0):
+    """trace の every 回ごとに、1回しか使われないページを scan_length 個続けて挟む
+
+    Tests:
+    >>> scan_trace(["a", "b", "c"], 2, 2)
+    ['a', 'b', 'scan0-0', 'scan0-1', 'c']
+    """
+    result = []
+    for i, key in enumerate(trace):
+        if i and i % every == 0:
+            result.extend("scan%d-%d" % (i // every - 1, j) for j in range(scan_length))
+        result.append(key)
+    return result
+
+
+def simulate(trace, capacity, policy_name):
+    """trace の順にページを get して、なければ put した時のヒット率
+
+    Tests:
+    >>> simulate(["a", "b", "a", "c", "a", "b"], 2, "lru")
+    0.3333333333333333
+    """
+    cache = HashTable(policy=POLICIES[policy_name](capacity))
+    hits = 0
+    for key in trace:
+        _, found = cache.get(key)
+        if found:
+            hits += 1
+        else:
+            cache.put(key, key)
+        assert cache.size() <= capacity
+    return hits / len(trace)
+
+
+def main():
+    traces = {
+        "zipf": zipf_trace(200000, 50000),
+        "zipf+scan": scan_trace(zipf_trace(200000, 50000), 2000, 10000),
+    }
+    capacities = [100, 1000, 5000]
+    for trace_name, trace in traces.items():
+        print(f"{trace_name}: {len(trace)} accesses")
+        print("  capacity" + "".join(f"{name:>10}" for name in POLICIES))
+        for capacity in capacities:
+            ratios = [simulate(trace, capacity, name) for name in POLICIES]
+            print(f"  {capacity:>8}" + "".join(f"{ratio:>10.3f}" for ratio in ratios))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
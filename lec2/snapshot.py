@@ -0,0 +1,165 @@
+import math
+import os
+import pickle
+import struct
+import sys
+import time
+from array import array
+from itertools import accumulate
+
+# How to use:
+#
+# >>> from snapshot import write_snapshot, read_snapshot
+# >>> write_snapshot(path, keys, values)          # q1/hash_tables.py, q4/cache.py の snapshot から使う
+# >>> keys, values, weights, expires = read_snapshot(path)
+#
+# ファイルの形(数字は全部リトルエンディアン):
+#     ヘッダ       MAGIC(8byte), flags(4byte), 要素の数(8byte)
+#     キー         文字数の array('I')、つなげた UTF-8 の byte 数(8byte)、全部のキーをつなげた UTF-8
+#     値           flags に VALUES_STR があれば、キーと同じ形。なければ pickle した list(長さ 8byte + 中身)
+#     weight       flags に HAS_WEIGHTS があれば array('q')
+#     期限         flags に HAS_EXPIRES があれば、期限の時刻(time.time())の array('d')。期限なしは nan
+#
+# 文字列は1つずつ書かずに、つなげて1回で encode/decode して、配列ごと read/write する。
+# array.tobytes() はその CPU のバイトオーダーで書くので、ビッグエンディアンの CPU では
+# write_array/read_array で byteswap して、どこで書いたファイルでも同じ形にする。
+
+MAGIC = b"STEPSNP1"
+HEADER = struct.Struct("<8sIQ")
+LENGTH = struct.Struct("<Q")
+VALUES_STR = 1
+HAS_WEIGHTS = 2
+HAS_EXPIRES = 4
+
+
+def write_array(f, values):
+    """array をリトルエンディアンで書く。ビッグエンディアンの CPU では values を書き換えるので、書いた後は使わないこと
+
+    Tests:
+    >>> import io
+    >>> f = io.BytesIO()
+    >>> write_array(f, array("I", [1, 256]))
+    >>> f.getvalue() == struct.pack("<2I", 1, 256)
+    True
+    >>> _ = f.seek(0)
+    >>> read_array(f, "I", 2)
+    array('I', [1, 256])
+    """
+    if sys.byteorder != "little":
+        values.byteswap()
+    f.write(values.tobytes())
+
+
+def read_array(f, typecode, count):
+    """write_array で書いた count 個の要素を読む"""
+    values = array(typecode)
+    values.frombytes(f.read(values.itemsize * count))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def write_strings(f, strings):
+    """strings の文字数と、つなげて1回で encode したものを書く"""
+    write_array(f, array("I", map(len, strings)))
+    data = "".join(strings).encode("utf-8", "surrogatepass")
+    f.write(LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def read_strings(f, count):
+    """write_strings で書いた count 個の文字列を読む。1回で decode して、文字数で切り出す"""
+    lengths = read_array(f, "I", count)
+    ends = list(accumulate(lengths))
+    # UTF-8 は1文字が1〜4byteなので、文字数の合計からは byte 数がわからない。byte 数は別に書いてある
+    size = LENGTH.unpack(f.read(LENGTH.size))[0]
+    text = f.read(size).decode("utf-8", "surrogatepass")
+    return [text[end - length:end] for end, length in zip(ends, lengths)]
+
+
+def write_snapshot(path, keys, values, weights=None, expires=None):
+    """keys[i], values[i] を path に書く。途中で落ちても前のファイルが壊れないように、別のファイルに書いてから置き換える
+
+    Args:
+        keys (list[str]): キー。この順番のまま read_snapshot で返ってくる
+        values (list): 値。全部 str なら pickle しない
+        weights (list[int] | None): 値の大きさ
+        expires (list[float | None] | None): 期限の時刻(time.time())。期限なしは None
+
+    Returns:
+        int: 書いたファイルの大きさ(byte)
+
+    Tests:
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "snapshot")
+    >>> write_snapshot(path, ["a", "ねこ", ""], ["x", "", "yz"], expires=[None, 2.5, None]) > 0
+    True
+    >>> read_snapshot(path)
+    (['a', 'ねこ', ''], ['x', '', 'yz'], None, [None, 2.5, None])
+    >>> _ = write_snapshot(path, ["a", "b"], [1, (2, 3)], weights=[10, 20])
+    >>> read_snapshot(path)
+    (['a', 'b'], [1, (2, 3)], [10, 20], None)
+    """
+    flags = 0
+    values_str = all(type(value) == str for value in values)
+    if values_str:
+        flags |= VALUES_STR
+    if weights is not None:
+        flags |= HAS_WEIGHTS
+    if expires is not None:
+        flags |= HAS_EXPIRES
+    temporary_path = str(path) + ".tmp"
+    with open(temporary_path, "wb", buffering=1 << 20) as f:
+        f.write(HEADER.pack(MAGIC, flags, len(keys)))
+        write_strings(f, keys)
+        if values_str:
+            write_strings(f, values)
+        else:
+            data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(LENGTH.pack(len(data)))
+            f.write(data)
+        if weights is not None:
+            write_array(f, array("q", weights))
+        if expires is not None:
+            write_array(f, array("d", (math.nan if expire is None else expire
+                                       for expire in expires)))
+        size = f.tell()
+    os.replace(temporary_path, path)
+    return size
+
+
+def read_snapshot(path):
+    """write_snapshot で書いたファイルを読む
+
+    Returns:
+        tuple: (keys, values, weights, expires)。書かなかったものは None
+    """
+    with open(path, "rb", buffering=1 << 20) as f:
+        magic, flags, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        keys = read_strings(f, count)
+        if flags & VALUES_STR:
+            values = read_strings(f, count)
+        else:
+            size = LENGTH.unpack(f.read(LENGTH.size))[0]
+            values = pickle.loads(f.read(size))
+        weights = None
+        if flags & HAS_WEIGHTS:
+            weights = read_array(f, "q", count).tolist()
+        expires = None
+        if flags & HAS_EXPIRES:
+            expires = read_array(f, "d", count)
+            expires = [None if math.isnan(expire) else expire for expire in expires]
+    return keys, values, weights, expires
+
+
+def remaining_ttls(expires, now=None):
+    """期限の時刻(time.time())を、今からの秒数にする。期限なしは None、もう過ぎていたら 0 以下
+
+    Tests:
+    >>> remaining_ttls([None, 15.0], now=10.0)
+    [None, 5.0]
+    """
+    now = time.time() if now is None else now
+    return [None if expire is None else expire - now for expire in expires]
@@ -1,4 +1,8 @@
 #! /usr/bin/python3
+import sys
+import time
+
+
 def match_any(token, *types):
     """tokenがtypesのいずれかとマッチするときTrueを返す
 
@@ -330,6 +334,135 @@ def paren_evaluate(tokens):
     return multiply_divide_evaluate(tokens)
 
 
+# compile_tokens が作る命令の、演算子の強さ。NEGATE は -x のような単項のマイナス
+PRECEDENCE = {'PLUS': 1, 'MINUS': 1, 'MULTIPLY': 2, 'DIVIDE': 2, 'NEGATE': 3}
+START_PARENS = ['PAREN_START', 'ABS_PAREN', 'INT_PAREN', 'ROUND_PAREN']
+
+
+def compile_tokens(tokens):
+    """トークンの配列を、後置記法(逆ポーランド記法)の命令の列にする(操車場アルゴリズム)
+
+    paren_evaluate はトークンの配列を pop/insert しながら計算するので、1つの式で O(n^2) かかり、
+    かっこの中を取り出すたびに残りを見直す。compile_tokens はトークンを1回だけ前から見て、
+    再帰せずに命令の列を作る。同じ式を何回も計算する時は、1回 compile して execute だけ繰り返せばよい。
+
+    Args:
+        tokens (Tokens): tokenize が返したトークンの配列(最初の PLUS も含む)
+
+    Returns:
+        List[Tuple]: 命令の列。('NUMBER', 数字), ('PLUS', None), ('MINUS', None), ('MULTIPLY', None),
+                     ('DIVIDE', None), ('NEGATE', None), ('CALL', 関数) のどれか
+
+    Tests:
+    >>> compile_tokens(tokenize('1 + 2 * 3'))
+    [('NUMBER', 1), ('NUMBER', 2), ('NUMBER', 3), ('MULTIPLY', None), ('PLUS', None)]
+    >>> compile_tokens(tokenize('-(1 - 2)'))
+    [('NUMBER', 1), ('NUMBER', 2), ('MINUS', None), ('NEGATE', None)]
+    >>> compile_tokens(tokenize('abs(2 * -3)'))
+    [('NUMBER', 2), ('NUMBER', 3), ('NEGATE', None), ('MULTIPLY', None), ('CALL', <built-in function abs>)]
+    """
+    program = []
+    operators = []  # まだ出していない演算子と、開いているかっこ
+    # 次が数字(か開きかっこか単項の符号)であるべき時 True。最初の PLUS は単項の符号として読む
+    expect_operand = True
+    for token in tokens:
+        token_type = token['type']
+        if token_type == 'NUMBER':
+            if not expect_operand:
+                print('compile_tokens(): Invalid syntax: ', end="")
+                token_print(tokens)
+                exit(1)
+            program.append(('NUMBER', token['number']))
+            expect_operand = False
+        elif match_any(token_type, *START_PARENS):
+            if not expect_operand:
+                print('compile_tokens(): Invalid syntax: ', end="")
+                token_print(tokens)
+                exit(1)
+            operators.append(token_type)
+        elif token_type == 'PAREN_END':
+            if expect_operand:
+                print('compile_tokens(): Invalid syntax: ', end="")
+                token_print(tokens)
+                exit(1)
+            while operators and not match_any(operators[-1], *START_PARENS):
+                program.append((operators.pop(), None))
+            if not operators:
+                print('compile_tokens(): Unmatched parenthesis: ', end="")
+                token_print(tokens)
+                exit(1)
+            paren = operators.pop()
+            if paren != 'PAREN_START':
+                program.append(('CALL', get_function(paren)))
+        elif expect_operand:
+            # 数字の前の + と - は単項の符号。+ は何もしない
+            if token_type == 'MINUS':
+                operators.append('NEGATE')
+            elif token_type != 'PLUS':
+                print('compile_tokens(): Invalid syntax: ', end="")
+                token_print(tokens)
+                exit(1)
+        else:
+            # 二項演算子。左結合なので、同じ強さ以上の演算子を先に出す
+            while (operators and not match_any(operators[-1], *START_PARENS)
+                   and PRECEDENCE[operators[-1]] >= PRECEDENCE[token_type]):
+                program.append((operators.pop(), None))
+            operators.append(token_type)
+            expect_operand = True
+    if expect_operand:
+        print('compile_tokens(): Invalid syntax: ', end="")
+        token_print(tokens)
+        exit(1)
+    while operators:
+        operator = operators.pop()
+        if match_any(operator, *START_PARENS):
+            print('compile_tokens(): Unmatched parenthesis: ', end="")
+            token_print(tokens)
+            exit(1)
+        program.append((operator, None))
+    return program
+
+
+def execute(program):
+    """compile_tokens が作った命令の列を、スタックを使って前から1回だけ見て計算する
+
+    Args:
+        program (List[Tuple]): compile_tokens が返した命令の列
+
+    Returns:
+        number: 計算結果
+
+    Tests:
+    >>> execute(compile_tokens(tokenize('(1+2) * -3')))
+    -9
+    >>> execute(compile_tokens(tokenize('round(1.4) + abs(-1) + int(1.5)')))
+    3
+    """
+    stack = []
+    for operator, value in program:
+        # needs Python3.10
+        match operator:
+            case 'NUMBER':
+                stack.append(value)
+            case 'PLUS':
+                right = stack.pop()
+                stack[-1] += right
+            case 'MINUS':
+                right = stack.pop()
+                stack[-1] -= right
+            case 'MULTIPLY':
+                right = stack.pop()
+                stack[-1] *= right
+            case 'DIVIDE':
+                right = stack.pop()
+                stack[-1] /= right
+            case 'NEGATE':
+                stack[-1] = -stack[-1]
+            case 'CALL':
+                stack[-1] = value(stack[-1])
+    return stack[0]
+
+
 def evaluate(tokens):
     """トークンを受け取って、計算結果を返す
 
@@ -339,7 +472,7 @@ def evaluate(tokens):
     Returns:
         number: 計算結果
     """
-    answer = paren_evaluate(tokens)
+    answer = execute(compile_tokens(tokens))
     return answer
 
 
@@ -385,13 +518,55 @@ def run_test():
     test("round(1.4) + abs(-1) + int(1.5)")
     test("(1+3 + (1 + 4)) * (1+2)")
     test("8 * (1+2) / int(8/3)")
+    test("2*-3")
+    test("-(1+2)")
+    test("- -2")
+    test("-2*-2")
+    test("4/-2/2")
+    test("1-2-3")
+    test("2*3/4*5")
+    test("abs(-2*3)")
+    test("-abs(1-3)")
+    test("int(-1.5)")
+    test("round(2.5) + round(3.5)")
+    test("abs(int(round(1.6) - 3.5))")
+    test("(" * 150 + "1+2" + ")" * 150)  # eval はかっこ 200 段までしか読めない
+    test("+".join(str(i) for i in range(1000)))
     print("==== Test finished! ====\n")
 
 
+def benchmark(line, count=10000):
+    """line を count 回計算して、毎回 tokenize して paren_evaluate する時と、1回だけ compile して execute する時を比べる"""
+    begin = time.perf_counter()
+    for _ in range(count):
+        paren_answer = paren_evaluate(tokenize(line))
+    paren_time = time.perf_counter() - begin
+    begin = time.perf_counter()
+    program = compile_tokens(tokenize(line))
+    for _ in range(count):
+        answer = execute(program)
+    execute_time = time.perf_counter() - begin
+    assert abs(answer - paren_answer) < 1e-8
+    print("%d tokens x %d: paren_evaluate %.3fs, compile + execute %.3fs (x%.1f)" % (
+        len(tokenize(line)), count, paren_time, execute_time, paren_time / execute_time))
+
+
+def run_benchmark():
+    print("==== Benchmark started! ====")
+    benchmark("8 * (1+2) / int(8/3)", 10000)
+    benchmark("round(1.4) + abs(3 - 1) * (4 + 5 * (6 - 7)) / int(8.9)", 10000)
+    benchmark("+".join("%d*%d" % (i, i + 1) for i in range(200)), 100)
+    benchmark("(" * 100 + "1+2" + ")" * 100, 100)
+    print("==== Benchmark finished! ====\n")
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()  # 関数ごとのテスト
     run_test()
+    if "benchmark" in sys.argv[1:]:
+        # $ python modularized_calculator.py benchmark
+        run_benchmark()
     # while True:
     #     print('> ', end="")
     #     line = input()